@@ -3,8 +3,36 @@
 包括主持人Agent和玩家Agent
 """
 
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
+import asyncio
+import functools
 import json
+import re
+from api_utils import SemanticCache, call_model, call_model_async
+
+
+# 主持人只需回答"是"/"否"/"不重要"，限制输出长度并在句末停止以缩短解码时间
+HOST_ANSWER_OPTIONS = {
+    "max_tokens": 5,
+    "stop": ["。", "\n"],
+    "temperature": 0
+}
+
+# 一次扫描找出回答中最先出现的类别；"不是"需排在"是"之前，否则会被误判为"是"
+_ANSWER_RE = re.compile(r"不相关|无关|不重要|不是|是|否|\byes\b|\bno\b", re.IGNORECASE)
+_ANSWER_LABELS = {
+    "不相关": "不重要",
+    "无关": "不重要",
+    "不重要": "不重要",
+    "不是": "否",
+    "是": "是",
+    "否": "否",
+    "yes": "是",
+    "no": "否"
+}
+
+# 玩家回复开头的格式标记，如"[提问]"
+QUESTION_TAG_RE = re.compile(r"^\s*\[[^\]]*\]\s*")
 
 
 class HostAgent:
@@ -12,20 +40,29 @@ class HostAgent:
     主持人Agent - 负责给出汤面并回答玩家的是非问题
     """
 
-    def __init__(self, puzzle_data: Dict):
+    def __init__(self, puzzle_data: Dict, semantic_cache: Optional[SemanticCache] = None):
         """
         初始化主持人Agent
 
         Args:
             puzzle_data: 包含surface、bottom、key_question等信息的谜题数据
+            semantic_cache: 可选的语义缓存。提供时，与已回答过的问题语义相近的新问题
+                直接沿用之前的回答；缓存按系统提示（即谜题）分桶，不同谜题互不影响
         """
         self.surface = puzzle_data["surface"]
         self.bottom = puzzle_data["bottom"]
         self.key_questions = puzzle_data["key_question"]
         self.story_tree = puzzle_data["story_tree"]
+        # 系统提示在整局游戏中不变，构建一次后复用；保持逐字节一致也便于服务端的提示前缀缓存命中
+        self._system_prompt = self._build_system_prompt()
+        self.semantic_cache = semantic_cache
 
     def get_system_prompt(self) -> str:
-        """生成主持人的系统提示"""
+        """返回主持人的系统提示（在初始化时构建）"""
+        return self._system_prompt
+
+    def _build_system_prompt(self) -> str:
+        """构建主持人的系统提示"""
         return f"""你是一个海龟汤游戏的主持人。你知道完整的故事真相。
 
 **汤面（谜题）：**
@@ -53,59 +90,248 @@ class HostAgent:
 主持人："不重要。"
 """
 
-    def answer_question(self, question: str, model_api_call) -> str:
+    def answer_question(
+        self,
+        question: str,
+        model_api_call,
+        answer_cache: Optional[Dict[str, str]] = None
+    ) -> str:
         """
         根据问题回答是/否/不重要
 
         Args:
             question: 玩家的问题
-            model_api_call: 调用LLM的函数
+            model_api_call: 调用LLM的函数（如果接受max_tokens、stop、temperature等关键字参数，
+                会收到限制回答长度的生成参数）
+            answer_cache: 本局已回答过的问题的记录（规范化后的问题 -> 回答），重复提问直接返回记录的回答，
+                新的回答会写入其中。主持人可被多局游戏共用，记录由每局游戏各自持有，
+                以免不同的游戏（如不同模型的对比局）互相沿用回答；不提供时不记录
 
         Returns:
-            主持人的回答
+            主持人的回答（"是"、"否"或"不重要"）
+        """
+        answer_cache = {} if answer_cache is None else answer_cache
+        key = self.canonicalize_question(question)
+        cached, vec = self._lookup_answer(key, answer_cache)
+        if cached is not None:
+            return cached
+
+        response = call_model(
+            model_api_call,
+            self.get_system_prompt(),
+            self._build_answer_prompt(question),
+            **HOST_ANSWER_OPTIONS
+        )
+        answer = self.normalize_answer(response)
+        self._remember_answer(key, answer, vec, answer_cache)
+        return answer
+
+    async def answer_question_async(
+        self,
+        question: str,
+        model_api_call,
+        answer_cache: Optional[Dict[str, str]] = None
+    ) -> str:
+        """answer_question 的异步版本"""
+        answer_cache = {} if answer_cache is None else answer_cache
+        key = self.canonicalize_question(question)
+        if self.semantic_cache is None:
+            cached, vec = self._lookup_answer(key, answer_cache)
+        else:
+            # 向量化可能较慢，放到线程池中执行
+            cached, vec = await asyncio.to_thread(self._lookup_answer, key, answer_cache)
+        if cached is not None:
+            return cached
+
+        response = await call_model_async(
+            model_api_call,
+            self.get_system_prompt(),
+            self._build_answer_prompt(question),
+            **HOST_ANSWER_OPTIONS
+        )
+        answer = self.normalize_answer(response)
+        if self.semantic_cache is None:
+            self._remember_answer(key, answer, vec, answer_cache)
+        else:
+            await asyncio.to_thread(self._remember_answer, key, answer, vec, answer_cache)
+        return answer
+
+    def _lookup_answer(self, key: str, answer_cache: Dict[str, str]) -> Tuple[Optional[str], object]:
         """
-        prompt = f"""基于你掌握的故事真相，请回答玩家的问题。
+        查找已有的回答：先在answer_cache中精确匹配，再查语义缓存
 
-玩家问题：{question}
+        Returns:
+            (已有的回答或None, 问题的向量（供写入语义缓存时复用）)
+        """
+        if key in answer_cache:
+            return answer_cache[key], None
+        if self.semantic_cache is None:
+            return None, None
+
+        cached, vec = self.semantic_cache.lookup(self.get_system_prompt(), key)
+        if cached is not None:
+            answer_cache[key] = cached
+        return cached, vec
+
+    def _remember_answer(self, key: str, answer: str, vec, answer_cache: Dict[str, str]):
+        """记录回答"""
+        answer_cache[key] = answer
+        if self.semantic_cache is not None:
+            self.semantic_cache.store(self.get_system_prompt(), key, answer, vec)
+
+    @staticmethod
+    def canonicalize_question(question: str) -> str:
+        """
+        规范化问题文本，用于识别重复提问（去掉格式标记、首尾空白、大小写和句末标点）
 
-请只回答"是"、"否"或"不重要"，可以选择性地添加一句简短的引导语。"""
+        Args:
+            question: 玩家的问题
 
-        return model_api_call(self.get_system_prompt(), prompt)
+        Returns:
+            规范化后的问题
+        """
+        return QUESTION_TAG_RE.sub("", question).strip().lower().rstrip("？?。.！! ")
 
+    @staticmethod
+    def normalize_answer(response: str) -> str:
+        """
+        将主持人的回复归一化为"是"、"否"或"不重要"
 
-class PlayerAgent:
+        Args:
+            response: LLM的原始回复
+
+        Returns:
+            归一化后的回答，无法识别时返回"不重要"
+        """
+        match = _ANSWER_RE.search(response)
+        if match is None:
+            return "不重要"
+        return _ANSWER_LABELS[match.group(0).lower()]
+
+    def _build_answer_prompt(self, question: str) -> str:
+        """构建回答问题的用户提示"""
+        # 固定的说明放在前面、变化的问题放在最后，以延长可缓存的公共前缀
+        return f"""基于你掌握的故事真相，请回答玩家的问题。
+请只回答"是"、"否"或"不重要"，不要添加其他内容。
+
+玩家问题：{question}"""
+
+
+# 玩家回合的结构化输出格式（API调用函数接受response_schema参数时使用）
+PLAYER_TURN_SCHEMA = {
+    "name": "submit_turn",
+    "description": "提交本回合的提问或推理",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "intent": {"type": "string", "enum": ["question", "guess", "final_guess"]},
+            "text": {"type": "string"}
+        },
+        "required": ["intent", "text"],
+        "additionalProperties": False
+    }
+}
+
+# 结构化输出的intent对应的格式标记
+_INTENT_TAGS = {
+    "question": "[提问]",
+    "guess": "[推理]",
+    "final_guess": "[最终推理]"
+}
+
+
+def _parse_structured_turn(response: str) -> str:
     """
-    玩家Agent - 通过提问来推理汤底
+    把结构化输出的玩家回合（{"intent": ..., "text": ...}）转换为带格式标记的回复，如"[提问] ..."；
+    不是结构化输出的回复原样返回
     """
+    if not response.lstrip().startswith("{"):
+        return response
+    try:
+        parsed = json.loads(response)
+    except ValueError:
+        return response
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("text"), str):
+        return response
+    tag = _INTENT_TAGS.get(parsed.get("intent"))
+    if tag is None:
+        return response
+    return f"{tag} {QUESTION_TAG_RE.sub('', parsed['text']).strip()}"
 
-    def __init__(self, player_name: str, strategy: str = "systematic"):
-        """
-        初始化玩家Agent
 
-        Args:
-            player_name: 玩家名称（如"Player1"、"Player2"）
-            strategy: 提问策略（systematic=系统化提问, creative=创造性提问）
-        """
-        self.player_name = player_name
-        self.strategy = strategy
-        self.conversation_history = []
+# 以"[提问]"开头、标记后有问题内容、已经完整收到的第一行
+_QUESTION_LINE_RE = re.compile(r"\s*(\[提问\][^\S\n]*\S[^\n]*)\n")
 
-    def get_system_prompt(self, surface: str) -> str:
-        """生成玩家的系统提示"""
-        strategy_guide = {
-            "systematic": """你应该采用系统化的提问策略：
+
+def _question_line(text: str) -> Tuple[bool, Optional[str]]:
+    """
+    判断已收到的玩家回复能否提前结束
+
+    每回合只提一个问题，"[提问]"所在行之后的内容不会被用到，收到完整的一行即可停止；
+    推理、格式不符或标记单独成行（问题在下一行）的回复需要完整读取
+
+    Returns:
+        (第一行是否已完整收到, 提问行（可以提前结束时）或None)
+    """
+    match = _QUESTION_LINE_RE.match(text)
+    if match is not None:
+        return True, match.group(1).rstrip()
+    return "\n" in text.lstrip(), None
+
+
+def _read_player_turn(chunks) -> str:
+    """读取玩家回复的文本段，回复是提问时在第一行结束后停止读取并关闭流"""
+    parts = []
+    decided = False
+    for chunk in chunks:
+        parts.append(chunk)
+        if decided or "\n" not in chunk:
+            continue
+        decided, question = _question_line("".join(parts))
+        if question is not None:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            return question
+    return "".join(parts)
+
+
+async def _aread_player_turn(chunks) -> str:
+    """_read_player_turn 的异步版本"""
+    parts = []
+    decided = False
+    async for chunk in chunks:
+        parts.append(chunk)
+        if decided or "\n" not in chunk:
+            continue
+        decided, question = _question_line("".join(parts))
+        if question is not None:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            return question
+    return "".join(parts)
+
+
+# 各提问策略的说明
+_STRATEGY_GUIDE = {
+    "systematic": """你应该采用系统化的提问策略：
 1. 先确认基本事实（人物、地点、时间）
 2. 排除明显的可能性
 3. 逐步缩小范围
 4. 关注异常点和矛盾之处""",
-            "creative": """你应该采用创造性的提问策略：
+    "creative": """你应该采用创造性的提问策略：
 1. 大胆假设，从不同角度思考
 2. 关注细节和隐藏信息
 3. 尝试反常识的可能性
 4. 寻找故事中的关键转折点"""
-        }
+}
 
-        return f"""你是海龟汤游戏的玩家{self.player_name}。你需要通过提出是非问题来解开谜题。
+
+@functools.lru_cache(maxsize=8)
+def _build_player_system_prompt(player_name: str, strategy: str, surface: str) -> str:
+    """构建玩家的系统提示"""
+    return f"""你是海龟汤游戏的玩家{player_name}。你需要通过提出是非问题来解开谜题。
 
 **汤面（已知信息）：**
 {surface}
@@ -116,7 +342,7 @@ class PlayerAgent:
 3. 当你认为已经了解真相时，可以说出你的推理
 
 **你的策略：**
-{strategy_guide.get(self.strategy, strategy_guide["systematic"])}
+{_STRATEGY_GUIDE.get(strategy, _STRATEGY_GUIDE["systematic"])}
 
 **注意：**
 - 每次只提一个问题
@@ -130,25 +356,193 @@ class PlayerAgent:
 [推理] 你认为的完整故事
 """
 
-    def ask_question(self, surface: str, conversation_history: List[Dict], model_api_call) -> str:
+
+class PlayerAgent:
+    """
+    玩家Agent - 通过提问来推理汤底
+    """
+
+    def __init__(self, player_name: str, strategy: str = "systematic", *, surface: str):
+        """
+        初始化玩家Agent
+
+        Args:
+            player_name: 玩家名称（如"Player1"、"Player2"）
+            strategy: 提问策略（systematic=系统化提问, creative=创造性提问）
+            surface: 汤面，系统提示在初始化时据此构建一次，之后每次调用直接复用
+        """
+        self.player_name = player_name
+        self.strategy = strategy
+        self.surface = surface
+        self._system_prompt = _build_player_system_prompt(player_name, strategy, surface)
+        self.conversation_history = []
+
+        # 已渲染的对话历史（对话历史只会追加，每回合只渲染新增部分）
+        self._history_parts: List[str] = []
+        self._history_text: Optional[str] = ""
+        self._first_history_item: Optional[Dict] = None
+        self._last_history_item: Optional[Dict] = None
+
+    def get_system_prompt(self) -> str:
+        """返回玩家的系统提示（在初始化时构建）"""
+        return self._system_prompt
+
+    def ask_question(self, conversation_history: List[Dict], model_api_call) -> str:
         """
         基于当前信息提出问题
 
         Args:
-            surface: 汤面
             conversation_history: 对话历史
             model_api_call: 调用LLM的函数
 
         Returns:
             玩家的问题或推理
+
+        如果model_api_call接受response_schema参数，会要求按PLAYER_TURN_SCHEMA输出JSON，
+        再转换为带格式标记的回复；如果接受stream参数，会以流式方式请求：回复是提问时
+        读到第一行结束即停止，不必等待（和支付）模型在问题之后附加的内容
+        """
+        user_prompt = self._build_question_prompt(conversation_history)
+        response = call_model(
+            model_api_call,
+            self.get_system_prompt(),
+            user_prompt,
+            stream=True,
+            response_schema=PLAYER_TURN_SCHEMA,
+            **self._prefix_options()
+        )
+        if isinstance(response, str):
+            # 完整的回复（包括缓存中记录的提前停止的流）按流式读取的规则截取提问行
+            return _parse_structured_turn(_read_player_turn([response]))
+        return _parse_structured_turn(_read_player_turn(response))
+
+    async def ask_question_async(self, conversation_history: List[Dict], model_api_call) -> str:
+        """ask_question 的异步版本"""
+        user_prompt = self._build_question_prompt(conversation_history)
+        response = await call_model_async(
+            model_api_call,
+            self.get_system_prompt(),
+            user_prompt,
+            stream=True,
+            response_schema=PLAYER_TURN_SCHEMA,
+            **self._prefix_options()
+        )
+        if isinstance(response, str):
+            # 完整的回复（包括缓存中记录的提前停止的流）按流式读取的规则截取提问行
+            return _parse_structured_turn(_read_player_turn([response]))
+        if not hasattr(response, "__aiter__"):
+            # 同步函数（在线程池中调用）返回的普通迭代器，同样放到线程池中读取
+            return _parse_structured_turn(await asyncio.to_thread(_read_player_turn, response))
+        return _parse_structured_turn(await _aread_player_turn(response))
+
+    def make_final_guess(
+        self,
+        conversation_history: List[Dict],
+        model_api_call,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """
+        做出最终推理
+
+        Args:
+            conversation_history: 对话历史
+            model_api_call: 调用LLM的函数
+            on_token: 可选的进度回调。提供时以流式方式请求（API调用函数需接受stream参数），
+                每收到一段文本就回调一次；不支持流式的函数会把完整回复作为一段回调
+
+        Returns:
+            玩家的最终推理
+        """
+        system_prompt = self.get_system_prompt()
+        user_prompt = self._build_final_guess_prompt(conversation_history)
+        options = self._prefix_options()
+
+        if on_token is None:
+            return call_model(model_api_call, system_prompt, user_prompt, **options)
+
+        response = call_model(model_api_call, system_prompt, user_prompt, stream=True, **options)
+        if isinstance(response, str):
+            on_token(response)
+            return response
+
+        parts = []
+        for chunk in response:
+            parts.append(chunk)
+            on_token(chunk)
+        return "".join(parts)
+
+    async def make_final_guess_async(self, conversation_history: List[Dict], model_api_call) -> str:
+        """make_final_guess 的异步版本"""
+        user_prompt = self._build_final_guess_prompt(conversation_history)
+        return await call_model_async(
+            model_api_call,
+            self.get_system_prompt(),
+            user_prompt,
+            **self._prefix_options()
+        )
+
+    def _prefix_options(self) -> Dict:
+        """
+        提示前缀缓存的参数：把已渲染的对话历史按回合切成文本块（prefix_blocks），
+        拼接后恰好是用户提示的开头部分。历史只会在末尾追加，之前的文本块在后续回合中保持不变，
+        支持的API（如Anthropic）可据此逐回合命中缓存。需在构建用户提示之后调用
+        """
+        if not self._history_parts:
+            return {}
+        blocks = ["**对话历史：**\n" + self._history_parts[0]]
+        blocks.extend("\n" + part for part in self._history_parts[1:])
+        return {"prefix_blocks": blocks}
+
+    def append_turn(self, player: str, question: str, answer: str):
         """
-        # 构建对话历史
-        history_text = "\n".join([
-            f"{item['player']}: {item['question']}\n主持人: {item['answer']}"
-            for item in conversation_history
-        ])
+        向已渲染的对话历史追加一轮问答
 
-        prompt = f"""**对话历史：**
+        Args:
+            player: 提问的玩家名称
+            question: 问题
+            answer: 主持人的回答
+        """
+        self._history_parts.append(f"{player}: {question}\n主持人: {answer}")
+        self._history_text = None
+
+    def reset_history(self):
+        """清空已渲染的对话历史"""
+        self._history_parts = []
+        self._history_text = ""
+        self._first_history_item = None
+        self._last_history_item = None
+
+    def _format_history(self, conversation_history: List[Dict]) -> str:
+        """将对话历史格式化为文本，只渲染上次调用之后新增的回合"""
+        synced = len(self._history_parts)
+        if synced > len(conversation_history) or (synced and (
+            conversation_history[0] is not self._first_history_item
+            or conversation_history[synced - 1] is not self._last_history_item
+        )):
+            # 传入的不是之前那份历史的延续（如较早回合被压缩成了新的摘要），重新渲染
+            self.reset_history()
+            synced = 0
+
+        for item in conversation_history[synced:]:
+            if item.get("role") == "summary":
+                # 较早回合被压缩成的摘要
+                self._history_parts.append(f"（之前回合的摘要）{item['summary']}")
+                self._history_text = None
+            else:
+                self.append_turn(item['player'], item['question'], item['answer'])
+        if conversation_history:
+            self._first_history_item = conversation_history[0]
+            self._last_history_item = conversation_history[-1]
+
+        if self._history_text is None:
+            self._history_text = "\n".join(self._history_parts)
+        return self._history_text
+
+    def _build_question_prompt(self, conversation_history: List[Dict]) -> str:
+        """构建提问的用户提示"""
+        history_text = self._format_history(conversation_history)
+
+        return f"""**对话历史：**
 {history_text if history_text else "（还没有提问记录）"}
 
 现在轮到你{self.player_name}了。请根据汤面和对话历史，提出你的下一个问题或给出你的推理。
@@ -159,31 +553,14 @@ class PlayerAgent:
 [推理] 你的完整推理
 """
 
-        return model_api_call(self.get_system_prompt(surface), prompt)
-
-    def make_final_guess(self, surface: str, conversation_history: List[Dict], model_api_call) -> str:
-        """
-        做出最终推理
-
-        Args:
-            surface: 汤面
-            conversation_history: 对话历史
-            model_api_call: 调用LLM的函数
-
-        Returns:
-            玩家的最终推理
-        """
-        history_text = "\n".join([
-            f"{item['player']}: {item['question']}\n主持人: {item['answer']}"
-            for item in conversation_history
-        ])
+    def _build_final_guess_prompt(self, conversation_history: List[Dict]) -> str:
+        """构建最终推理的用户提示"""
+        history_text = self._format_history(conversation_history)
 
-        prompt = f"""**对话历史：**
+        return f"""**对话历史：**
 {history_text}
 
 现在请你给出最终推理，说出你认为的完整故事真相。请尽可能详细和完整。
 
 [最终推理]
 """
-
-        return model_api_call(self.get_system_prompt(surface), prompt)
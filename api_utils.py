@@ -0,0 +1,644 @@
+"""
+LLM API调用工具
+统一同步/异步API调用函数的调用方式，并提供响应缓存（精确匹配/语义相似）
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# 只影响请求传输方式、不影响回复内容的参数，不计入缓存键
+_HINT_OPTIONS = frozenset({"prefix_blocks"})
+
+
+def _options_scope(options: Optional[Dict]) -> str:
+    """将影响回复内容的生成参数转换为缓存键的一部分"""
+    if not options:
+        return ""
+    return repr(sorted((k, v) for k, v in options.items() if k not in _HINT_OPTIONS))
+
+
+# API调用函数 -> 可接受的关键字参数名；弱引用，不阻止调用函数（及其客户端）被回收
+_ACCEPTED_OPTIONS = weakref.WeakKeyDictionary()
+
+
+def _inspect_accepted_options(model_api_call: Callable) -> Optional[frozenset]:
+    """从函数签名中读取可接受的关键字参数名，None表示接受任意关键字参数"""
+    try:
+        params = inspect.signature(model_api_call).parameters.values()
+    except (TypeError, ValueError):
+        return frozenset()
+
+    names = set()
+    for param in params:
+        if param.kind is param.VAR_KEYWORD:
+            return None
+        if param.kind in (param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY):
+            names.add(param.name)
+    return frozenset(names)
+
+
+def _accepted_options(model_api_call: Callable) -> Optional[frozenset]:
+    """返回API调用函数可接受的关键字参数名（按函数对象缓存），None表示接受任意关键字参数"""
+    try:
+        return _ACCEPTED_OPTIONS[model_api_call]
+    except (KeyError, TypeError):
+        pass
+    accepted = _inspect_accepted_options(model_api_call)
+    try:
+        _ACCEPTED_OPTIONS[model_api_call] = accepted
+    except TypeError:
+        # 不支持弱引用的可调用对象不缓存
+        pass
+    return accepted
+
+
+def _supported_options(model_api_call: Callable, options: Dict) -> Dict:
+    """
+    过滤出API调用函数支持的生成参数（如max_tokens、stop、temperature）
+
+    只接受 (system_prompt, user_prompt) 两个参数的自定义函数会收到空字典，
+    因此生成参数只是提示，不会破坏已有的API调用函数
+    """
+    if not options:
+        return options
+    try:
+        accepted = _accepted_options(model_api_call)
+    except TypeError:
+        accepted = frozenset()
+    if accepted is None:
+        return options
+    return {k: v for k, v in options.items() if k in accepted}
+
+
+def call_model(model_api_call: Callable, system_prompt: str, user_prompt: str, **options) -> str:
+    """
+    调用LLM，并只传入该函数支持的生成参数
+
+    Args:
+        model_api_call: 调用LLM的函数
+        system_prompt: 系统提示
+        user_prompt: 用户提示
+        **options: 生成参数（如max_tokens、stop、temperature）
+
+    Returns:
+        LLM的回复
+    """
+    return model_api_call(system_prompt, user_prompt, **_supported_options(model_api_call, options))
+
+
+def per_event_loop(factory: Callable) -> Callable:
+    """
+    包装对象工厂，使每个事件循环只创建一个实例并复用
+
+    异步客户端的连接池绑定在创建它的事件循环上，不能跨asyncio.run()复用
+
+    Args:
+        factory: 无参数的工厂函数（如 lambda: AsyncOpenAI(api_key=...)）
+
+    Returns:
+        在事件循环内调用、返回当前循环专属实例的函数；其aclose属性是关闭当前循环实例的协程函数
+        （实例需提供异步的close()方法）
+    """
+    instances = weakref.WeakKeyDictionary()
+
+    def get_instance():
+        loop = asyncio.get_running_loop()
+        if loop not in instances:
+            instances[loop] = factory()
+        return instances[loop]
+
+    async def aclose():
+        instance = instances.pop(asyncio.get_running_loop(), None)
+        if instance is not None:
+            await instance.close()
+
+    get_instance.aclose = aclose
+    return get_instance
+
+
+async def aclose_models(*model_api_calls: Callable):
+    """
+    关闭API调用函数在当前事件循环中创建的异步客户端（即调用函数的aclose属性）
+
+    应在asyncio.run()返回之前调用，否则连接池随事件循环一起被丢弃，无法正常释放连接
+
+    Args:
+        *model_api_calls: API调用函数，没有aclose属性的（如模拟函数、None）会被忽略
+    """
+    closed = set()
+    for model_api_call in model_api_calls:
+        aclose = getattr(model_api_call, "aclose", None)
+        if aclose is not None and aclose not in closed:
+            closed.add(aclose)
+            await aclose()
+
+
+class RateLimiter:
+    """
+    请求速率限制（令牌桶）：平均每分钟最多rpm个请求，空闲后最多可连续发出burst个
+
+    同一个限速器可同时被多个线程和多个事件循环中的协程使用，共享同一份额度，
+    因此同步调用和异步调用合起来也不会超过服务商的每分钟请求数限制
+
+    Args:
+        rpm: 每分钟最多请求数
+        burst: 空闲后允许立即连续发出的请求数
+    """
+
+    def __init__(self, rpm: float, burst: int = 1):
+        if rpm <= 0:
+            raise ValueError(f"rpm必须大于0，当前为 {rpm}")
+        self.interval = 60.0 / rpm
+        self.burst = max(1, burst)
+        self._next_free = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """预订下一个请求名额，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next_free, now)
+            self._next_free = start + self.interval
+            return max(0.0, start - now - (self.burst - 1) * self.interval)
+
+    def acquire(self):
+        """阻塞当前线程直到可以发出下一个请求"""
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """等待直到可以发出下一个请求（不阻塞事件循环）"""
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def guard_requests(
+    retry_on: Tuple[type, ...],
+    max_attempts: int = 6,
+    max_concurrent: Optional[int] = None,
+    rpm: Optional[float] = None
+) -> Callable:
+    """
+    创建发送API请求的函数的装饰器：限制请求速率和同时进行的请求数，并在临时性错误时重试
+
+    重试使用tenacity（指数退避加随机抖动，1~30秒）；每次尝试各自经过限速器并获取并发名额，
+    等待重试期间不占用名额。同步函数使用线程信号量，协程函数使用所在事件循环的信号量；
+    同一个装饰器装饰的所有函数共用一个限速器
+
+    Args:
+        retry_on: 需要重试的异常类型（如限流、连接错误、服务端错误）
+        max_attempts: 最多尝试次数
+        max_concurrent: 同时进行的最大请求数，None表示不限制
+        rpm: 每分钟最多请求数，None表示不限制
+
+    Returns:
+        装饰器；未安装tenacity时只限速和限制并发、不重试，调用方可改用SDK自带的重试
+    """
+    try:
+        from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+        policy = retry(
+            stop=stop_after_attempt(max_attempts),
+            wait=wait_random_exponential(min=1, max=30),
+            retry=retry_if_exception_type(retry_on),
+            reraise=True
+        )
+    except ImportError:
+        policy = None
+    limiter = RateLimiter(rpm) if rpm else None
+
+    def decorate(send: Callable) -> Callable:
+        if max_concurrent is None and limiter is None:
+            guarded = send
+        elif inspect.iscoroutinefunction(send):
+            get_slots = per_event_loop(lambda: asyncio.Semaphore(max_concurrent)) if max_concurrent else None
+
+            @functools.wraps(send)
+            async def guarded(*args, **kwargs):
+                if limiter is not None:
+                    await limiter.acquire_async()
+                if get_slots is None:
+                    return await send(*args, **kwargs)
+                async with get_slots():
+                    return await send(*args, **kwargs)
+        else:
+            slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+
+            @functools.wraps(send)
+            def guarded(*args, **kwargs):
+                if limiter is not None:
+                    limiter.acquire()
+                if slots is None:
+                    return send(*args, **kwargs)
+                with slots:
+                    return send(*args, **kwargs)
+
+        return policy(guarded) if policy is not None else guarded
+
+    decorate.retries = policy is not None
+    return decorate
+
+
+@functools.lru_cache(maxsize=1)
+def _token_encoder():
+    """返回tiktoken编码器，未安装tiktoken时返回None"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数
+
+    安装了tiktoken时按cl100k_base编码计数，否则按字符数估算（中文大约每字一个token）
+
+    Args:
+        text: 文本
+
+    Returns:
+        token数
+    """
+    encoder = _token_encoder()
+    if encoder is None:
+        return len(text)
+    return len(encoder.encode(text))
+
+
+async def call_model_async(model_api_call: Callable, system_prompt: str, user_prompt: str, **options) -> str:
+    """
+    以异步方式调用LLM
+
+    如果model_api_call带有异步版本（acall属性）或本身是协程函数则直接await，
+    否则放到线程池中执行，避免阻塞事件循环
+
+    Args:
+        model_api_call: 调用LLM的函数（同步或异步）
+        system_prompt: 系统提示
+        user_prompt: 用户提示
+        **options: 生成参数（如max_tokens、stop、temperature）
+
+    Returns:
+        LLM的回复
+    """
+    async_call = getattr(model_api_call, "acall", None)
+    if async_call is not None:
+        return await async_call(system_prompt, user_prompt, **_supported_options(async_call, options))
+
+    options = _supported_options(model_api_call, options)
+    if inspect.iscoroutinefunction(model_api_call):
+        return await model_api_call(system_prompt, user_prompt, **options)
+    return await asyncio.to_thread(model_api_call, system_prompt, user_prompt, **options)
+
+
+def _record_stream(chunks, on_complete: Callable[[str], None]):
+    """
+    透传流式响应的文本段，读取结束时把已读到的文本交给on_complete
+
+    调用方提前停止读取（关闭生成器）时同样记录已读到的部分，并关闭上游的流；
+    上游出错时不记录
+    """
+    parts = []
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    except GeneratorExit:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+        if parts:
+            on_complete("".join(parts))
+        raise
+    on_complete("".join(parts))
+
+
+async def _record_stream_async(chunks, on_complete: Callable[[str], None]):
+    """_record_stream 的异步版本"""
+    parts = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    except GeneratorExit:
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        if parts:
+            on_complete("".join(parts))
+        raise
+    on_complete("".join(parts))
+
+
+def _wrap_with_cache(model_api_call: Callable, lookup: Callable, store: Callable) -> Callable:
+    """
+    为API调用函数加上缓存（ResponseCache和SemanticCache共用），同步/异步函数均可
+
+    如果函数带有异步版本（acall属性），异步版本同样会加上缓存；
+    流式响应缓存调用方实际读到的文本，命中时整段返回
+
+    Args:
+        model_api_call: 调用LLM的函数
+        lookup: 查找函数 func(system_prompt, user_prompt, options) -> (命中的响应或None, 写入时所需的信息)
+        store: 写入函数 func(system_prompt, user_prompt, options, 写入时所需的信息, response)
+
+    Returns:
+        带缓存的API调用函数
+    """
+    if inspect.iscoroutinefunction(model_api_call):
+        return _wrap_with_cache_async(model_api_call, lookup, store)
+
+    @functools.wraps(model_api_call)
+    def cached_call(system_prompt: str, user_prompt: str, **options) -> str:
+        cached, extra = lookup(system_prompt, user_prompt, options)
+        if cached is not None:
+            return cached
+        response = call_model(model_api_call, system_prompt, user_prompt, **options)
+        on_complete = functools.partial(store, system_prompt, user_prompt, options, extra)
+        if not isinstance(response, str):
+            return _record_stream(response, on_complete)
+        on_complete(response)
+        return response
+
+    if getattr(model_api_call, "acall", None) is not None:
+        cached_call.acall = _wrap_with_cache_async(model_api_call.acall, lookup, store)
+    return cached_call
+
+
+def _wrap_with_cache_async(model_api_call: Callable, lookup: Callable, store: Callable) -> Callable:
+    """_wrap_with_cache 的异步版本，查找和写入放到线程池中执行"""
+    @functools.wraps(model_api_call)
+    async def cached_call_async(system_prompt: str, user_prompt: str, **options) -> str:
+        cached, extra = await asyncio.to_thread(lookup, system_prompt, user_prompt, options)
+        if cached is not None:
+            return cached
+        response = await call_model_async(model_api_call, system_prompt, user_prompt, **options)
+        on_complete = functools.partial(store, system_prompt, user_prompt, options, extra)
+        if isinstance(response, str):
+            await asyncio.to_thread(on_complete, response)
+            return response
+        if hasattr(response, "__aiter__"):
+            return _record_stream_async(response, on_complete)
+        return _record_stream(response, on_complete)
+
+    return cached_call_async
+
+
+class ResponseCache:
+    """
+    LLM响应的精确匹配缓存，持久化到SQLite，重复运行实验时可直接复用
+
+    键为 (命名空间, system_prompt, user_prompt, 生成参数) 的BLAKE2b哈希，
+    命名空间用于区分不同的模型和默认温度
+    """
+
+    def __init__(self, path: str = "llm_cache.sqlite", namespace: str = ""):
+        """
+        初始化缓存
+
+        Args:
+            path: SQLite数据库文件路径
+            namespace: 命名空间（如 "openai:gpt-4:0"）
+        """
+        self.path = path
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response TEXT, ts INTEGER)"
+        )
+        self._conn.commit()
+
+    def make_key(self, system_prompt: str, user_prompt: str, options: Optional[Dict] = None) -> str:
+        """计算缓存键"""
+        scope = self.namespace + _options_scope(options)
+        return hashlib.blake2b(
+            "\x00".join((scope, system_prompt, user_prompt)).encode("utf-8"),
+            digest_size=16
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, response: str):
+        """写入缓存"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, response, ts) VALUES (?, ?, ?)",
+                (key, response, int(time.time()))
+            )
+            self._conn.commit()
+
+    def _lookup(self, system_prompt: str, user_prompt: str, options: Dict) -> Tuple[Optional[str], str]:
+        """查找缓存，返回(命中的响应或None, 缓存键)"""
+        key = self.make_key(system_prompt, user_prompt, options)
+        return self.get(key), key
+
+    def _store(self, system_prompt: str, user_prompt: str, options: Dict, key: str, response: str):
+        """以_lookup返回的缓存键写入缓存"""
+        self.set(key, response)
+
+    def wrap(self, model_api_call: Callable) -> Callable:
+        """
+        为API调用函数加上缓存，同步/异步函数均可（见_wrap_with_cache）
+
+        Args:
+            model_api_call: 调用LLM的函数
+
+        Returns:
+            带缓存的API调用函数
+        """
+        return _wrap_with_cache(model_api_call, self._lookup, self._store)
+
+
+class _VectorIndex:
+    """
+    内积向量索引，优先使用FAISS，未安装时退化为NumPy矩阵
+    """
+
+    def __init__(self, dim: int):
+        import numpy as np
+
+        self._np = np
+        try:
+            import faiss
+            self._faiss_index = faiss.IndexFlatIP(dim)
+        except ImportError:
+            self._faiss_index = None
+            self._matrix = np.zeros((0, dim), dtype=np.float32)
+
+    def search(self, vec) -> Tuple[float, int]:
+        """返回与vec内积最大的条目（分数, 下标），索引为空时下标为-1"""
+        if self._faiss_index is not None:
+            if self._faiss_index.ntotal == 0:
+                return 0.0, -1
+            scores, ids = self._faiss_index.search(vec[None, :], 1)
+            return float(scores[0][0]), int(ids[0][0])
+
+        if len(self._matrix) == 0:
+            return 0.0, -1
+        scores = self._matrix @ vec
+        best = int(scores.argmax())
+        return float(scores[best]), best
+
+    def add(self, vec):
+        """添加一个向量"""
+        if self._faiss_index is not None:
+            self._faiss_index.add(vec[None, :])
+        else:
+            self._matrix = self._np.vstack([self._matrix, vec[None, :]])
+
+    def drop_oldest(self, count: int):
+        """删除最早添加的count个向量，其余向量的下标相应前移"""
+        if self._faiss_index is not None:
+            import faiss
+            self._faiss_index.remove_ids(faiss.IDSelectorRange(0, count))
+        else:
+            self._matrix = self._matrix[count:]
+
+
+class SemanticCache:
+    """
+    LLM响应的语义缓存
+
+    两级查找：先按 (system_prompt, user_prompt) 精确匹配；未命中时，
+    在相同system_prompt下按user_prompt向量的余弦相似度查找最相近的历史请求。
+    不同的system_prompt（不同角色、不同谜题）各自使用独立的索引，互不干扰。
+    """
+
+    def __init__(self, embed_fn: Callable, threshold: float = 0.92, maxsize: int = 4096):
+        """
+        初始化语义缓存
+
+        Args:
+            embed_fn: 向量化函数，签名为 func(texts: List[str]) -> 形如 (len(texts), dim) 的向量
+            threshold: 语义命中所需的最小余弦相似度
+            maxsize: 精确匹配缓存和向量索引各自的最大条目数；超过时精确匹配缓存淘汰最久未用的条目，
+                向量索引从最久未用的系统提示分桶中淘汰最早加入的向量
+        """
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._exact: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._buckets: "OrderedDict[str, Tuple[_VectorIndex, List[str]]]" = OrderedDict()
+        self._vector_count = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _exact_key(system_prompt: str, user_prompt: str, options: Optional[Dict] = None) -> Tuple[str, str]:
+        # 生成参数不同的请求（如限制了max_tokens）视为不同的系统提示
+        scope = system_prompt + _options_scope(options)
+        return (
+            hashlib.blake2b(scope.encode("utf-8"), digest_size=16).hexdigest(),
+            hashlib.blake2b(user_prompt.encode("utf-8"), digest_size=16).hexdigest()
+        )
+
+    def _embed(self, text: str):
+        import numpy as np
+
+        vec = np.asarray(self.embed_fn([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def lookup(self, system_prompt: str, user_prompt: str, options: Optional[Dict] = None) -> Tuple[Optional[str], object]:
+        """
+        查找缓存
+
+        Returns:
+            (命中的响应或None, user_prompt的向量（精确命中时为None）)
+        """
+        key = self._exact_key(system_prompt, user_prompt, options)
+        with self._lock:
+            if key in self._exact:
+                self._exact.move_to_end(key)
+                self.hits += 1
+                return self._exact[key], None
+
+        vec = self._embed(user_prompt)
+        with self._lock:
+            bucket = self._buckets.get(key[0])
+            if bucket is not None:
+                self._buckets.move_to_end(key[0])
+                index, responses = bucket
+                score, idx = index.search(vec)
+                if idx >= 0 and score >= self.threshold:
+                    self.hits += 1
+                    self._remember_exact(key, responses[idx])
+                    return responses[idx], vec
+            self.misses += 1
+        return None, vec
+
+    def store(self, system_prompt: str, user_prompt: str, response: str, vec=None, options: Optional[Dict] = None):
+        """写入缓存"""
+        if vec is None:
+            vec = self._embed(user_prompt)
+        key = self._exact_key(system_prompt, user_prompt, options)
+        with self._lock:
+            self._remember_exact(key, response)
+
+            if key[0] not in self._buckets:
+                self._buckets[key[0]] = (_VectorIndex(len(vec)), [])
+            self._buckets.move_to_end(key[0])
+            index, responses = self._buckets[key[0]]
+            index.add(vec)
+            responses.append(response)
+            self._vector_count += 1
+            self._evict_vectors()
+
+    def _remember_exact(self, key: Tuple[str, str], response: str):
+        """写入精确匹配缓存，超出maxsize时淘汰最久未用的条目（需持有锁）"""
+        self._exact[key] = response
+        self._exact.move_to_end(key)
+        if len(self._exact) > self.maxsize:
+            self._exact.popitem(last=False)
+
+    def _evict_vectors(self):
+        """向量总数超出maxsize时，从最久未用的分桶中淘汰最早加入的向量（需持有锁）"""
+        while self._vector_count > self.maxsize:
+            bucket_key, (index, responses) = next(iter(self._buckets.items()))
+            count = min(len(responses), self._vector_count - self.maxsize)
+            if count == len(responses):
+                del self._buckets[bucket_key]
+            else:
+                index.drop_oldest(count)
+                del responses[:count]
+            self._vector_count -= count
+
+    def _store_with_vector(self, system_prompt: str, user_prompt: str, options: Dict, vec, response: str):
+        """以lookup返回的向量写入缓存"""
+        self.store(system_prompt, user_prompt, response, vec, options)
+
+    def wrap(self, model_api_call: Callable) -> Callable:
+        """
+        为API调用函数加上缓存，同步/异步函数均可（见_wrap_with_cache）
+
+        Args:
+            model_api_call: 调用LLM的函数
+
+        Returns:
+            带缓存的API调用函数
+        """
+        return _wrap_with_cache(model_api_call, self.lookup, self._store_with_vector)
@@ -3,8 +3,57 @@
 评估玩家的表现，包括问题质量和最终答案的准确性
 """
 
-from typing import Dict, List, Callable
+from typing import Dict, List, Callable, Optional, Tuple
+import inspect
+import json
 import re
+from concurrent.futures import ThreadPoolExecutor
+from agents import QUESTION_TAG_RE
+from api_utils import ResponseCache
+
+
+COVERAGE_SYSTEM_PROMPT = """你是一个评估专家，需要判断玩家的提问是否覆盖了关键问题。
+
+关键问题不需要字面上完全一致，只要语义上询问了相同或相关的内容即可。"""
+
+FINAL_GUESS_SYSTEM_PROMPT = """你是一个评估专家，需要评估玩家的推理与真相的相似度。
+
+请从以下维度评估：
+1. 核心情节是否正确（0-10分）
+2. 关键细节是否准确（0-10分）
+3. 逻辑推理是否合理（0-10分）
+4. 整体完整度（0-10分）
+
+并给出总体评分（0-100分）。"""
+
+# 一次扫描提取所有维度的分数
+_SCORE_RE = re.compile(
+    r"(?P<label>核心情节|关键细节|逻辑推理|整体完整度)[：:]\s*(?P<score>\d+)/10"
+    r"|总体评分[：:]\s*(?P<total>\d+)/100"
+)
+
+_SCORE_FIELDS = ["core_plot", "key_details", "logical_reasoning", "completeness", "total"]
+
+_SCORE_KEYS = {
+    "核心情节": "core_plot",
+    "关键细节": "key_details",
+    "逻辑推理": "logical_reasoning",
+    "整体完整度": "completeness"
+}
+
+
+def _map_concurrently(func: Callable, items: List) -> List:
+    """
+    同时对每一项调用func，按items的顺序返回结果
+
+    用于批量结果无法解析时的逐个回退评估：逐个串行调用时，批处理API调用函数
+    （见create_openai_batch_api_call）会为每个请求单独提交一个批次并等待完成；
+    同时调用则会被合并成一个批次
+    """
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+        return list(executor.map(func, items))
 
 
 class GameEvaluator:
@@ -12,19 +61,70 @@ class GameEvaluator:
     评估玩家在海龟汤游戏中的表现
     """
 
-    def __init__(self, game_log: Dict, model_api_call: Callable):
+    # 每次LLM调用中一并判断的关键问题数量
+    coverage_batch_size = 10
+    # 向量相似度不低于该值的关键问题直接判定为已覆盖
+    coverage_covered_threshold = 0.80
+    # 向量相似度不高于该值的关键问题直接判定为未覆盖
+    coverage_uncovered_threshold = 0.5
+    # 推理与真相的向量相似度在此区间内线性映射为0-10的核心情节分
+    core_plot_similarity_range = (0.3, 0.9)
+
+    def __init__(
+        self,
+        game_log: Dict,
+        model_api_call: Callable,
+        embed_fn: Optional[Callable] = None,
+        result_cache: Optional[ResponseCache] = None
+    ):
         """
         初始化评估器
 
         Args:
             game_log: 游戏日志
-            model_api_call: 调用LLM的函数
+            model_api_call: 调用LLM的同步函数（评估在调用线程中同步进行，不接受async def定义的函数）
+            embed_fn: 可选的向量化函数，签名为 func(texts: List[str]) -> 向量数组。
+                提供时先用向量相似度判断关键问题覆盖情况，只有难以判断的才交给LLM。
+                关键问题与玩家问题语言不同时应使用多语言向量模型
+            result_cache: 可选的评估结果缓存（如 ResponseCache("evaluations.sqlite", namespace=模型名)）。
+                以评估标准和被评估内容（真相+推理、关键问题+玩家问题）为键保存覆盖率和推理评分，
+                重复评估相同内容时不再调用LLM；不同评估模型应使用不同的命名空间
         """
+        if inspect.iscoroutinefunction(model_api_call):
+            raise TypeError("GameEvaluator需要同步的API调用函数，请传入同步函数（或带acall属性的同步函数）")
         self.game_log = game_log
         self.model_api_call = model_api_call
+        self.embed_fn = embed_fn
+        self.result_cache = result_cache
         self.key_questions = game_log["key_questions"]
         self.bottom = game_log["bottom"]
 
+    def _cache_key(self, system_prompt: str, *parts: str) -> Optional[str]:
+        """评估结果的缓存键（评估标准、被评估内容和评估方式），未启用缓存时返回None"""
+        if self.result_cache is None:
+            return None
+        options = {
+            "embed": self.embed_fn is not None,
+            "thresholds": (
+                self.coverage_covered_threshold,
+                self.coverage_uncovered_threshold,
+                self.core_plot_similarity_range
+            )
+        }
+        return self.result_cache.make_key(system_prompt, "\x00".join(parts), options)
+
+    def _cached_result(self, key: Optional[str]) -> Optional[Dict]:
+        """读取缓存的评估结果"""
+        if key is None:
+            return None
+        cached = self.result_cache.get(key)
+        return json.loads(cached) if cached is not None else None
+
+    def _store_result(self, key: Optional[str], result: Dict):
+        """保存评估结果"""
+        if key is not None:
+            self.result_cache.set(key, json.dumps(result, ensure_ascii=False))
+
     def evaluate_question_coverage(self) -> Dict:
         """
         评估玩家提出的问题是否覆盖了关键问题
@@ -39,19 +139,171 @@ class GameEvaluator:
             if not round_info.get("is_guess", False)
         ]
 
-        # 使用LLM判断每个关键问题是否被覆盖
+        key = self._cache_key(COVERAGE_SYSTEM_PROMPT, *self.key_questions, "", *player_questions)
+        cached = self._cached_result(key)
+        if cached is not None:
+            return cached
+
+        # 先用向量相似度筛掉明确的情况，再分批让LLM一次性判断剩余的关键问题
         coverage_results = {}
+        if player_questions:
+            pending = self.key_questions
+            if self.embed_fn is not None:
+                coverage_results, pending = self._gate_coverage_by_similarity(player_questions)
+
+            # 编号后的玩家问题文本只构建一次，所有批次共用
+            if pending:
+                player_q_text = "\n".join(f"{i+1}. {q}" for i, q in enumerate(player_questions))
+
+            for start in range(0, len(pending), self.coverage_batch_size):
+                batch = pending[start:start + self.coverage_batch_size]
+                coverage_results.update(
+                    self._evaluate_coverage_batch(batch, player_questions, player_q_text)
+                )
+        else:
+            for key_q in self.key_questions:
+                coverage_results[key_q] = {"covered": False, "response": "（玩家没有提出问题）"}
+
+        # 保持关键问题的原始顺序
+        coverage_results = {key_q: coverage_results[key_q] for key_q in self.key_questions}
 
-        for key_q in self.key_questions:
-            system_prompt = """你是一个评估专家，需要判断玩家的提问是否覆盖了关键问题。
+        # 计算覆盖率
+        covered_count = sum(1 for result in coverage_results.values() if result["covered"])
+        coverage_rate = covered_count / len(self.key_questions) if self.key_questions else 0
 
-关键问题不需要字面上完全一致，只要语义上询问了相同或相关的内容即可。"""
+        result = {
+            "coverage_details": coverage_results,
+            "covered_count": covered_count,
+            "total_key_questions": len(self.key_questions),
+            "coverage_rate": coverage_rate
+        }
+        self._store_result(key, result)
+        return result
+
+    def _gate_coverage_by_similarity(self, player_questions: List[str]) -> Tuple[Dict, List[str]]:
+        """
+        用向量相似度判断关键问题是否被覆盖
+
+        所有问题在一次向量化调用中完成，再对每个关键问题取与玩家问题的最大余弦相似度：
+        不低于coverage_covered_threshold视为覆盖，不高于coverage_uncovered_threshold视为未覆盖，
+        介于两者之间的交给LLM判断
 
-            user_prompt = f"""**关键问题：**
+        Args:
+            player_questions: 玩家提出的所有问题
+
+        Returns:
+            (已判定的覆盖结果, 需要LLM判断的关键问题列表)
+        """
+        import numpy as np
+
+        texts = [QUESTION_TAG_RE.sub("", q) for q in player_questions] + list(self.key_questions)
+        vecs = np.asarray(self.embed_fn(texts), dtype=np.float32)
+        vecs /= np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+
+        player_emb = vecs[:len(player_questions)]
+        key_emb = vecs[len(player_questions):]
+        sims = player_emb @ key_emb.T
+        best_idx = sims.argmax(axis=0)
+        best_sim = sims.max(axis=0)
+
+        results = {}
+        pending = []
+        for k, key_q in enumerate(self.key_questions):
+            similarity = float(best_sim[k])
+            if similarity >= self.coverage_covered_threshold:
+                results[key_q] = {
+                    "covered": True,
+                    "matched_question": player_questions[int(best_idx[k])],
+                    "similarity": similarity,
+                    "response": "（由向量相似度判定）"
+                }
+            elif similarity <= self.coverage_uncovered_threshold:
+                results[key_q] = {
+                    "covered": False,
+                    "matched_question": None,
+                    "similarity": similarity,
+                    "response": "（由向量相似度判定）"
+                }
+            else:
+                pending.append(key_q)
+
+        return results, pending
+
+    def _evaluate_coverage_batch(
+        self,
+        key_questions: List[str],
+        player_questions: List[str],
+        player_q_text: str
+    ) -> Dict:
+        """
+        用一次LLM调用判断一批关键问题是否被覆盖
+
+        Args:
+            key_questions: 本批次的关键问题
+            player_questions: 玩家提出的所有问题
+            player_q_text: 编号后的玩家问题文本
+
+        Returns:
+            每个关键问题的覆盖结果
+        """
+        key_q_text = "\n".join(f"{i+1}. {q}" for i, q in enumerate(key_questions))
+
+        user_prompt = f"""**关键问题：**
+{key_q_text}
+
+**玩家提出的所有问题：**
+{player_q_text}
+
+请逐一判断每个关键问题是否被玩家的问题覆盖（语义相似即可）。
+
+只输出JSON，不要输出其他内容，格式：
+{{"results": [{{"key_q_index": 1, "covered": true, "matched_question_index": 3}}, ...]}}
+其中key_q_index为关键问题编号，matched_question_index为覆盖该关键问题的玩家问题编号，未覆盖时为null。
+"""
+
+        response = self.model_api_call(COVERAGE_SYSTEM_PROMPT, user_prompt)
+        parsed = self._parse_json_response(response)
+
+        try:
+            items = {int(item["key_q_index"]): item for item in parsed["results"]}
+        except (TypeError, KeyError, ValueError):
+            # 无法解析批量结果时，退回逐个判断（同时发出）
+            return dict(zip(key_questions, _map_concurrently(
+                lambda key_q: self._evaluate_single_coverage(key_q, player_q_text), key_questions
+            )))
+
+        results = {}
+        for i, key_q in enumerate(key_questions, 1):
+            item = items.get(i, {})
+            matched_idx = item.get("matched_question_index")
+            matched_question = None
+            if isinstance(matched_idx, int) and 1 <= matched_idx <= len(player_questions):
+                matched_question = player_questions[matched_idx - 1]
+
+            results[key_q] = {
+                "covered": item.get("covered") is True,
+                "matched_question": matched_question,
+                "response": response
+            }
+
+        return results
+
+    def _evaluate_single_coverage(self, key_q: str, player_q_text: str) -> Dict:
+        """
+        用一次LLM调用判断单个关键问题是否被覆盖
+
+        Args:
+            key_q: 关键问题
+            player_q_text: 编号后的玩家问题文本
+
+        Returns:
+            覆盖结果
+        """
+        user_prompt = f"""**关键问题：**
 {key_q}
 
 **玩家提出的所有问题：**
-{chr(10).join([f"{i+1}. {q}" for i, q in enumerate(player_questions)])}
+{player_q_text}
 
 请判断玩家的问题中是否有覆盖到这个关键问题（语义相似即可）。
 
@@ -60,25 +312,33 @@ class GameEvaluator:
 [如果是，请说明是哪个问题]
 """
 
-            response = self.model_api_call(system_prompt, user_prompt)
-            is_covered = response.strip().startswith("是")
-
-            coverage_results[key_q] = {
-                "covered": is_covered,
-                "response": response
-            }
-
-        # 计算覆盖率
-        covered_count = sum(1 for result in coverage_results.values() if result["covered"])
-        coverage_rate = covered_count / len(self.key_questions) if self.key_questions else 0
+        response = self.model_api_call(COVERAGE_SYSTEM_PROMPT, user_prompt)
 
         return {
-            "coverage_details": coverage_results,
-            "covered_count": covered_count,
-            "total_key_questions": len(self.key_questions),
-            "coverage_rate": coverage_rate
+            "covered": response.strip().startswith("是"),
+            "response": response
         }
 
+    @staticmethod
+    def _parse_json_response(response: str) -> Optional[Dict]:
+        """
+        从LLM响应中解析JSON对象（允许前后带有多余文字或代码块标记）
+
+        Args:
+            response: LLM的响应
+
+        Returns:
+            解析出的字典，失败时返回None
+        """
+        start = response.find("{")
+        end = response.rfind("}")
+        if start == -1 or end < start:
+            return None
+        try:
+            return json.loads(response[start:end + 1])
+        except json.JSONDecodeError:
+            return None
+
     def evaluate_final_guess(self, player_name: str) -> Dict:
         """
         评估玩家最终推理的准确性
@@ -91,16 +351,6 @@ class GameEvaluator:
         """
         final_guess = self.game_log["final_guesses"].get(player_name, "")
 
-        system_prompt = """你是一个评估专家，需要评估玩家的推理与真相的相似度。
-
-请从以下维度评估：
-1. 核心情节是否正确（0-10分）
-2. 关键细节是否准确（0-10分）
-3. 逻辑推理是否合理（0-10分）
-4. 整体完整度（0-10分）
-
-并给出总体评分（0-100分）。"""
-
         user_prompt = f"""**真相：**
 {self.bottom}
 
@@ -115,7 +365,7 @@ class GameEvaluator:
 总体评分：X/100
 """
 
-        response = self.model_api_call(system_prompt, user_prompt)
+        response = self.model_api_call(FINAL_GUESS_SYSTEM_PROMPT, user_prompt)
 
         # 解析评分
         scores = self._parse_scores(response)
@@ -127,6 +377,119 @@ class GameEvaluator:
             "scores": scores
         }
 
+    def evaluate_final_guesses(self) -> Dict:
+        """
+        用一次LLM调用评估所有玩家的最终推理
+
+        提供了embed_fn时，核心情节分改由推理与真相的向量相似度计算，总分按调整后的四个维度重新折算；
+        LLM的批量结果无法解析时退回逐个玩家评估。启用了结果缓存时，
+        推理与之前评估过的相同的玩家直接使用缓存的评分，只评估其余玩家
+
+        Returns:
+            以玩家名称为键的评估结果
+        """
+        final_guesses = self.game_log["final_guesses"]
+        results = {}
+        pending = []
+        keys = {}
+        for name, final_guess in final_guesses.items():
+            keys[name] = self._cache_key(FINAL_GUESS_SYSTEM_PROMPT, self.bottom, final_guess)
+            cached = self._cached_result(keys[name])
+            if cached is not None:
+                results[name] = {"player_name": name, "final_guess": final_guess, **cached}
+            else:
+                pending.append(name)
+
+        if pending:
+            for name, result in self._evaluate_final_guesses_batch(pending).items():
+                self._store_result(keys[name], {
+                    "evaluation_response": result["evaluation_response"],
+                    "scores": result["scores"]
+                })
+                results[name] = result
+
+        return {name: results[name] for name in final_guesses}
+
+    def _evaluate_final_guesses_batch(self, player_names: List[str]) -> Dict:
+        """
+        用一次LLM调用评估指定玩家的最终推理
+
+        Args:
+            player_names: 玩家名称列表
+
+        Returns:
+            以玩家名称为键的评估结果
+        """
+        final_guesses = self.game_log["final_guesses"]
+
+        guesses_text = "\n\n".join(
+            f"玩家{i}（{name}）：\n{final_guesses[name]}"
+            for i, name in enumerate(player_names, 1)
+        )
+        user_prompt = f"""**真相：**
+{self.bottom}
+
+**各玩家的推理：**
+{guesses_text}
+
+请分别评估每位玩家的推理。只输出JSON，不要输出其他内容，格式：
+{{"players": [{{"index": 1, "core_plot": X, "key_details": X, "logical_reasoning": X, "completeness": X, "total": X}}, ...]}}
+其中index为玩家编号，前四项为0-10分，total为0-100分。
+"""
+
+        response = self.model_api_call(FINAL_GUESS_SYSTEM_PROMPT, user_prompt)
+        parsed = self._parse_json_response(response)
+
+        try:
+            items = {int(item["index"]): item for item in parsed["players"]}
+            batch_scores = {
+                name: {key: int(items[i][key]) for key in _SCORE_FIELDS}
+                for i, name in enumerate(player_names, 1)
+            }
+        except (TypeError, KeyError, ValueError):
+            # 无法解析批量结果时，退回逐个评估（同时发出）
+            results = dict(zip(player_names, _map_concurrently(self.evaluate_final_guess, player_names)))
+        else:
+            results = {
+                name: {
+                    "player_name": name,
+                    "final_guess": final_guesses[name],
+                    "evaluation_response": response,
+                    "scores": batch_scores[name]
+                }
+                for name in player_names
+            }
+
+        if self.embed_fn is not None:
+            for name, core_plot in zip(player_names, self._score_core_plot_by_similarity(player_names)):
+                scores = results[name]["scores"]
+                scores["core_plot"] = core_plot
+                # 总分与调整后的各维度保持一致：四个维度（各10分）折算为百分制
+                scores["total"] = int(round(2.5 * sum(scores[field] for field in _SCORE_KEYS.values())))
+
+        return results
+
+    def _score_core_plot_by_similarity(self, player_names: List[str]) -> List[int]:
+        """
+        根据推理与真相的向量余弦相似度计算核心情节分（0-10）
+
+        Args:
+            player_names: 玩家名称列表
+
+        Returns:
+            按player_names顺序排列的核心情节分
+        """
+        import numpy as np
+
+        texts = [self.bottom] + [self.game_log["final_guesses"][name] for name in player_names]
+        vecs = np.asarray(self.embed_fn(texts), dtype=np.float32)
+        vecs /= np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+        sims = vecs[1:] @ vecs[0]
+
+        low, high = self.core_plot_similarity_range
+        scaled = np.clip((sims - low) / (high - low), 0.0, 1.0)
+        return [int(round(10 * value)) for value in scaled]
+
     def _parse_scores(self, response: str) -> Dict:
         """
         从评估响应中解析分数
@@ -145,19 +508,17 @@ class GameEvaluator:
             "total": 0
         }
 
-        # 使用正则表达式提取分数
-        patterns = {
-            "core_plot": r"核心情节[：:]\s*(\d+)/10",
-            "key_details": r"关键细节[：:]\s*(\d+)/10",
-            "logical_reasoning": r"逻辑推理[：:]\s*(\d+)/10",
-            "completeness": r"整体完整度[：:]\s*(\d+)/10",
-            "total": r"总体评分[：:]\s*(\d+)/100"
-        }
+        # 使用正则表达式提取分数，每个维度以第一次出现为准
+        found = set()
+        for match in _SCORE_RE.finditer(response):
+            if match.group("total") is not None:
+                key, value = "total", match.group("total")
+            else:
+                key, value = _SCORE_KEYS[match.group("label")], match.group("score")
 
-        for key, pattern in patterns.items():
-            match = re.search(pattern, response)
-            if match:
-                scores[key] = int(match.group(1))
+            if key not in found:
+                found.add(key)
+                scores[key] = int(value)
 
         return scores
 
@@ -193,36 +554,37 @@ class GameEvaluator:
             "player_stats": player_stats
         }
 
-    def evaluate_all(self) -> Dict:
+    def evaluate_all(self, verbose: bool = True) -> Dict:
         """
         执行完整评估
 
+        Args:
+            verbose: 是否输出评估进度（多局游戏同时评估时应关闭，以免各局的输出交错）
+
         Returns:
             完整评估结果
         """
-        print("\n" + "="*60)
-        print("开始评估游戏表现...")
-        print("="*60)
+        log = print if verbose else (lambda *args: None)
+        log("\n" + "="*60)
+        log("开始评估游戏表现...")
+        log("="*60)
 
         # 评估问题覆盖率
-        print("\n1. 评估关键问题覆盖率...")
+        log("\n1. 评估关键问题覆盖率...")
         coverage_eval = self.evaluate_question_coverage()
-        print(f"   覆盖了 {coverage_eval['covered_count']}/{coverage_eval['total_key_questions']} 个关键问题")
-        print(f"   覆盖率: {coverage_eval['coverage_rate']:.1%}")
+        log(f"   覆盖了 {coverage_eval['covered_count']}/{coverage_eval['total_key_questions']} 个关键问题")
+        log(f"   覆盖率: {coverage_eval['coverage_rate']:.1%}")
 
         # 评估每个玩家的最终推理
-        print("\n2. 评估玩家最终推理...")
-        player_evaluations = {}
-        for player_name in self.game_log["final_guesses"].keys():
-            print(f"   评估 {player_name}...")
-            player_eval = self.evaluate_final_guess(player_name)
-            player_evaluations[player_name] = player_eval
-            print(f"   {player_name} 总分: {player_eval['scores']['total']}/100")
+        log("\n2. 评估玩家最终推理...")
+        player_evaluations = self.evaluate_final_guesses()
+        for player_name, player_eval in player_evaluations.items():
+            log(f"   {player_name} 总分: {player_eval['scores']['total']}/100")
 
         # 评估游戏效率
-        print("\n3. 评估游戏效率...")
+        log("\n3. 评估游戏效率...")
         efficiency_eval = self.evaluate_game_efficiency()
-        print(f"   使用回合数: {efficiency_eval['total_rounds']}/{efficiency_eval['max_rounds']}")
+        log(f"   使用回合数: {efficiency_eval['total_rounds']}/{efficiency_eval['max_rounds']}")
 
         evaluation_result = {
             "coverage_evaluation": coverage_eval,
@@ -233,53 +595,67 @@ class GameEvaluator:
         # 将评估结果添加到游戏日志
         self.game_log["evaluation"] = evaluation_result
 
-        print("\n" + "="*60)
-        print("评估完成！")
-        print("="*60)
+        log("\n" + "="*60)
+        log("评估完成！")
+        log("="*60)
 
         return evaluation_result
 
-    def print_detailed_report(self):
-        """
-        打印详细评估报告
+    @staticmethod
+    def format_report(game_log: Dict) -> str:
         """
-        if "evaluation" not in self.game_log:
-            print("请先运行 evaluate_all() 方法")
-            return
+        生成详细评估报告的文本（标题中注明谜题编号）
 
-        eval_result = self.game_log["evaluation"]
+        Args:
+            game_log: 已经过evaluate_all评估的游戏日志
 
-        print("\n" + "#"*60)
-        print("详细评估报告")
-        print("#"*60)
+        Returns:
+            报告文本；日志尚未评估时返回提示信息
+        """
+        if "evaluation" not in game_log:
+            return "请先运行 evaluate_all() 方法"
+
+        eval_result = game_log["evaluation"]
+        lines = [
+            "\n" + "#"*60,
+            f"详细评估报告（谜题 {game_log.get('puzzle_index', '?')}）",
+            "#"*60
+        ]
 
         # 关键问题覆盖率
-        print("\n【关键问题覆盖情况】")
+        lines.append("\n【关键问题覆盖情况】")
         coverage = eval_result["coverage_evaluation"]
-        print(f"覆盖率: {coverage['coverage_rate']:.1%} ({coverage['covered_count']}/{coverage['total_key_questions']})")
-        print("\n详细情况:")
+        lines.append(f"覆盖率: {coverage['coverage_rate']:.1%} ({coverage['covered_count']}/{coverage['total_key_questions']})")
+        lines.append("\n详细情况:")
         for i, (key_q, result) in enumerate(coverage["coverage_details"].items(), 1):
             status = "✓" if result["covered"] else "✗"
-            print(f"{i}. {status} {key_q}")
+            lines.append(f"{i}. {status} {key_q}")
 
         # 玩家评分
-        print("\n【玩家表现评分】")
+        lines.append("\n【玩家表现评分】")
         for player_name, player_eval in eval_result["player_evaluations"].items():
             scores = player_eval["scores"]
-            print(f"\n{player_name}:")
-            print(f"  核心情节: {scores['core_plot']}/10")
-            print(f"  关键细节: {scores['key_details']}/10")
-            print(f"  逻辑推理: {scores['logical_reasoning']}/10")
-            print(f"  整体完整度: {scores['completeness']}/10")
-            print(f"  总体评分: {scores['total']}/100")
+            lines.append(f"\n{player_name}:")
+            lines.append(f"  核心情节: {scores['core_plot']}/10")
+            lines.append(f"  关键细节: {scores['key_details']}/10")
+            lines.append(f"  逻辑推理: {scores['logical_reasoning']}/10")
+            lines.append(f"  整体完整度: {scores['completeness']}/10")
+            lines.append(f"  总体评分: {scores['total']}/100")
 
         # 游戏效率
-        print("\n【游戏效率】")
+        lines.append("\n【游戏效率】")
         efficiency = eval_result["efficiency_evaluation"]
-        print(f"回合使用: {efficiency['total_rounds']}/{efficiency['max_rounds']}")
-        print(f"效率评分: {efficiency['efficiency_rate']:.1%}")
-        print("\n各玩家提问统计:")
+        lines.append(f"回合使用: {efficiency['total_rounds']}/{efficiency['max_rounds']}")
+        lines.append(f"效率评分: {efficiency['efficiency_rate']:.1%}")
+        lines.append("\n各玩家提问统计:")
         for player, stats in efficiency["player_stats"].items():
-            print(f"  {player}: {stats['questions']} 个问题, {stats['guesses']} 次推理")
+            lines.append(f"  {player}: {stats['questions']} 个问题, {stats['guesses']} 次推理")
+
+        lines.append("\n" + "#"*60)
+        return "\n".join(lines)
 
-        print("\n" + "#"*60)
+    def print_detailed_report(self):
+        """
+        打印详细评估报告
+        """
+        print(self.format_report(self.game_log))
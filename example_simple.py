@@ -4,10 +4,19 @@
 """
 
 import json
+import logging
+import re
+import sys
 from game_controller import TurtleSoupGame
 from evaluator import GameEvaluator
 
 
+# 模拟主持人：问题中出现这些关键词时回答"是"
+_MOCK_HOST_KEYWORDS = ["假死", "fake", "犯罪", "illegal"]
+# 所有关键词合并为一个正则，一次扫描即可判断
+_MOCK_HOST_RE = re.compile("|".join(map(re.escape, _MOCK_HOST_KEYWORDS)), re.IGNORECASE)
+
+
 def simple_mock_api(system_prompt: str, user_prompt: str) -> str:
     """
     简单的模拟API函数，用于演示
@@ -15,9 +24,7 @@ def simple_mock_api(system_prompt: str, user_prompt: str) -> str:
     """
     # 这里只是返回固定响应，实际应该调用真实API
     if "主持人" in system_prompt:
-        if "假死" in user_prompt or "fake" in user_prompt.lower():
-            return "是。"
-        elif "犯罪" in user_prompt or "illegal" in user_prompt.lower():
+        if _MOCK_HOST_RE.search(user_prompt):
             return "是。"
         else:
             return "不重要。"
@@ -29,6 +36,9 @@ def simple_mock_api(system_prompt: str, user_prompt: str) -> str:
 
 
 def main():
+    # 游戏过程通过logging输出
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
     # 1. 加载谜题数据
     with open("test.json", 'r', encoding='utf-8') as f:
         puzzles = json.load(f)
@@ -4,20 +4,109 @@
 """
 
 import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from agents import HostAgent
 from game_controller import TurtleSoupGame
 from evaluator import GameEvaluator
-from run_experiment import create_openai_api_call, create_anthropic_api_call, create_mock_api_call
+from run_experiment import (
+    create_openai_api_call,
+    create_openai_batch_api_call,
+    create_anthropic_api_call,
+    create_mock_api_call,
+    load_puzzles
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def save_json(obj, filepath: str):
+    """保存JSON文件，安装了orjson时使用更快的orjson"""
+    if orjson is not None:
+        with open(filepath, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+
+
+# 同时运行的最大游戏局数
+MAX_PARALLEL_GAMES = 4
+
+# 后台保存日志的线程池，让写文件与下一局游戏重叠进行
+_IO_POOL = ThreadPoolExecutor(max_workers=2)
+
+
+def _setup_logging():
+    """
+    游戏过程通过logging输出；调用方尚未配置日志时，把INFO级别的日志输出到标准输出
+
+    并发运行多局时各局输出会交错，可事先把日志级别设为WARNING以关闭逐回合输出
+    """
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
+
+def _wait_for_saves(futures):
+    """等待后台保存完成，并抛出保存过程中的异常"""
+    for future in futures:
+        future.result()
+
+
+def _run_one(puzzle, api_call, players, log_path, host=None, evaluate=False):
+    """
+    运行一局实验游戏，完成后立即保存日志（在线程池中执行，中途出错不会丢失已完成的局）
+
+    Args:
+        puzzle: 谜题数据
+        api_call: LLM API调用函数
+        players: 玩家配置
+        log_path: 日志保存路径
+        host: 共用的主持人
+        evaluate: 是否在保存前评估
+
+    Returns:
+        游戏日志
+    """
+    game = TurtleSoupGame(puzzle, api_call, max_rounds=20, players_config=players, host=host)
+    log = game.run_game()
+    if evaluate:
+        # 多局并发运行，不输出评估进度以免各局的输出交错
+        GameEvaluator(log, api_call).evaluate_all(verbose=False)
+    game.save_game_log(log_path)
+    return log
+
+
+def _run_parallel(jobs):
+    """
+    用线程池并发运行多局互相独立的游戏
+
+    Args:
+        jobs: _run_one 的参数字典列表
+
+    Returns:
+        按jobs顺序排列的游戏日志
+    """
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_GAMES) as executor:
+        futures = [executor.submit(_run_one, **job) for job in jobs]
+        for future in as_completed(futures):
+            future.result()
+    return [future.result() for future in futures]
 
 
 # =============================================================================
 # 实验1: 对比不同模型在同一谜题上的表现
 # =============================================================================
 def experiment_compare_models():
-    """对比GPT-4和Claude在同一谜题上的表现"""
-    with open("test.json", 'r', encoding='utf-8') as f:
-        puzzles = json.load(f)
+    """对比GPT-4和Claude在同一谜题上的表现（两局游戏并发运行）"""
+    _setup_logging()
+    puzzles = load_puzzles()
 
     puzzle = puzzles[0]
+    host = HostAgent(puzzle)
 
     # 配置相同的玩家设置
     players = [
@@ -25,108 +114,99 @@ def experiment_compare_models():
         {"name": "Player2", "strategy": "creative"}
     ]
 
-    # 测试GPT-4
     print("=" * 60)
-    print("实验1: 使用 GPT-4")
-    print("=" * 60)
-    gpt4_api = create_openai_api_call(model="gpt-4")
-    game1 = TurtleSoupGame(puzzle, gpt4_api, max_rounds=20, players_config=players)
-    log1 = game1.run_game()
-    evaluator1 = GameEvaluator(log1, gpt4_api)
-    evaluator1.evaluate_all()
-    game1.save_game_log("experiment1_gpt4.json")
-
-    # 测试Claude
-    print("\n" + "=" * 60)
-    print("实验1: 使用 Claude")
+    print("实验1: 同时使用 GPT-4 和 Claude")
     print("=" * 60)
-    claude_api = create_anthropic_api_call()
-    game2 = TurtleSoupGame(puzzle, claude_api, max_rounds=20, players_config=players)
-    log2 = game2.run_game()
-    evaluator2 = GameEvaluator(log2, claude_api)
-    evaluator2.evaluate_all()
-    game2.save_game_log("experiment1_claude.json")
+    _run_parallel([
+        # 测试GPT-4
+        dict(puzzle=puzzle, api_call=create_openai_api_call(model="gpt-4"), players=players,
+             log_path="experiment1_gpt4.json", host=host, evaluate=True),
+        # 测试Claude
+        dict(puzzle=puzzle, api_call=create_anthropic_api_call(), players=players,
+             log_path="experiment1_claude.json", host=host, evaluate=True)
+    ])
 
 
 # =============================================================================
 # 实验2: 对比不同提问策略的效果
 # =============================================================================
 def experiment_compare_strategies():
-    """对比系统化策略vs创造性策略"""
-    with open("test.json", 'r', encoding='utf-8') as f:
-        puzzles = json.load(f)
+    """对比系统化策略vs创造性策略（三局游戏并发运行）"""
+    _setup_logging()
+    puzzles = load_puzzles()
 
     puzzle = puzzles[0]
-    api_call = create_openai_api_call(model="gpt-4")
+    host = HostAgent(puzzle)
 
-    # 测试两个系统化玩家
-    print("=" * 60)
-    print("实验2a: 两个系统化玩家")
-    print("=" * 60)
+    # 两个系统化玩家
     players_systematic = [
         {"name": "系统派A", "strategy": "systematic"},
         {"name": "系统派B", "strategy": "systematic"}
     ]
-    game1 = TurtleSoupGame(puzzle, api_call, max_rounds=20, players_config=players_systematic)
-    log1 = game1.run_game()
-    game1.save_game_log("experiment2_systematic.json")
-
-    # 测试两个创造性玩家
-    print("\n" + "=" * 60)
-    print("实验2b: 两个创造性玩家")
-    print("=" * 60)
+    # 两个创造性玩家
     players_creative = [
         {"name": "创意派A", "strategy": "creative"},
         {"name": "创意派B", "strategy": "creative"}
     ]
-    game2 = TurtleSoupGame(puzzle, api_call, max_rounds=20, players_config=players_creative)
-    log2 = game2.run_game()
-    game2.save_game_log("experiment2_creative.json")
-
-    # 测试混合策略
-    print("\n" + "=" * 60)
-    print("实验2c: 混合策略玩家")
-    print("=" * 60)
+    # 混合策略玩家
     players_mixed = [
         {"name": "系统派", "strategy": "systematic"},
         {"name": "创意派", "strategy": "creative"}
     ]
-    game3 = TurtleSoupGame(puzzle, api_call, max_rounds=20, players_config=players_mixed)
-    log3 = game3.run_game()
-    game3.save_game_log("experiment2_mixed.json")
+
+    print("=" * 60)
+    print("实验2: 同时测试系统化、创造性、混合策略玩家")
+    print("=" * 60)
+    # 每局使用独立的客户端，避免线程间争用连接池
+    _run_parallel([
+        dict(puzzle=puzzle, api_call=create_openai_api_call(model="gpt-4"), players=players,
+             log_path=log_path, host=host)
+        for players, log_path in [
+            (players_systematic, "experiment2_systematic.json"),
+            (players_creative, "experiment2_creative.json"),
+            (players_mixed, "experiment2_mixed.json")
+        ]
+    ])
 
 
 # =============================================================================
 # 实验3: 多轮重复实验，测试稳定性
 # =============================================================================
 def experiment_stability(num_runs=3):
-    """对同一谜题进行多次实验，分析稳定性"""
-    with open("test.json", 'r', encoding='utf-8') as f:
-        puzzles = json.load(f)
+    """对同一谜题进行多次实验，分析稳定性（各局的评估最后通过Batch API一起完成）"""
+    _setup_logging()
+    puzzles = load_puzzles()
 
     puzzle = puzzles[0]
+    host = HostAgent(puzzle)
     api_call = create_openai_api_call(model="gpt-4")
+    # 评估不需要实时结果，并发评估的请求会合并成批次提交，费用减半
+    batch_api_call = create_openai_batch_api_call(model="gpt-4")
 
     players = [
         {"name": "Player1", "strategy": "systematic"},
         {"name": "Player2", "strategy": "creative"}
     ]
 
-    results = []
-
+    games = []
     for i in range(num_runs):
         print(f"\n{'=' * 60}")
         print(f"实验3: 第 {i+1}/{num_runs} 轮")
         print('=' * 60)
 
-        game = TurtleSoupGame(puzzle, api_call, max_rounds=20, players_config=players)
-        log = game.run_game()
-
-        evaluator = GameEvaluator(log, api_call)
-        eval_result = evaluator.evaluate_all()
-
-        game.save_game_log(f"experiment3_run{i+1}.json")
-        results.append(eval_result)
+        game = TurtleSoupGame(puzzle, api_call, max_rounds=20, players_config=players, host=host)
+        game.run_game()
+        games.append(game)
+
+    # 评估结果会写入游戏日志，评估完成后再保存
+    with ThreadPoolExecutor(max_workers=num_runs) as executor:
+        results = list(executor.map(
+            lambda game: GameEvaluator(game.game_log, batch_api_call).evaluate_all(verbose=False), games
+        ))
+    pending_saves = [
+        _IO_POOL.submit(game.save_game_log, f"experiment3_run{i+1}.json")
+        for i, game in enumerate(games)
+    ]
 
     # 分析结果
     print("\n" + "=" * 60)
@@ -138,12 +218,12 @@ def experiment_stability(num_runs=3):
     print(f"平均值: {sum(coverage_rates)/len(coverage_rates):.1%}")
 
     # 保存汇总结果
-    with open("experiment3_summary.json", 'w', encoding='utf-8') as f:
-        json.dump({
-            "num_runs": num_runs,
-            "coverage_rates": coverage_rates,
-            "all_results": results
-        }, f, ensure_ascii=False, indent=2)
+    save_json({
+        "num_runs": num_runs,
+        "coverage_rates": coverage_rates,
+        "all_results": results
+    }, "experiment3_summary.json")
+    _wait_for_saves(pending_saves)
 
 
 # =============================================================================
@@ -151,8 +231,8 @@ def experiment_stability(num_runs=3):
 # =============================================================================
 def experiment_difficulty():
     """测试模型在不同难度谜题上的表现"""
-    with open("test.json", 'r', encoding='utf-8') as f:
-        puzzles = json.load(f)
+    _setup_logging()
+    puzzles = load_puzzles()
 
     api_call = create_openai_api_call(model="gpt-4")
 
@@ -162,6 +242,7 @@ def experiment_difficulty():
     ]
 
     # 测试前3个谜题（假设难度递增）
+    pending_saves = []
     for i, puzzle in enumerate(puzzles[:3]):
         print(f"\n{'=' * 60}")
         print(f"实验4: 谜题 #{i+1}")
@@ -175,7 +256,9 @@ def experiment_difficulty():
         evaluator.evaluate_all()
         evaluator.print_detailed_report()
 
-        game.save_game_log(f"experiment4_puzzle{i+1}.json")
+        pending_saves.append(_IO_POOL.submit(game.save_game_log, f"experiment4_puzzle{i+1}.json"))
+
+    _wait_for_saves(pending_saves)
 
 
 # =============================================================================
@@ -183,10 +266,11 @@ def experiment_difficulty():
 # =============================================================================
 def experiment_player_count():
     """测试不同数量玩家的效果"""
-    with open("test.json", 'r', encoding='utf-8') as f:
-        puzzles = json.load(f)
+    _setup_logging()
+    puzzles = load_puzzles()
 
     puzzle = puzzles[0]
+    host = HostAgent(puzzle)
     api_call = create_openai_api_call(model="gpt-4")
 
     # 2个玩家
@@ -197,9 +281,9 @@ def experiment_player_count():
         {"name": "Player1", "strategy": "systematic"},
         {"name": "Player2", "strategy": "creative"}
     ]
-    game1 = TurtleSoupGame(puzzle, api_call, max_rounds=20, players_config=players_2)
+    game1 = TurtleSoupGame(puzzle, api_call, max_rounds=20, players_config=players_2, host=host)
     game1.run_game()
-    game1.save_game_log("experiment5_2players.json")
+    save1 = _IO_POOL.submit(game1.save_game_log, "experiment5_2players.json")
 
     # 3个玩家
     print("\n" + "=" * 60)
@@ -210,9 +294,9 @@ def experiment_player_count():
         {"name": "Player2", "strategy": "creative"},
         {"name": "Player3", "strategy": "systematic"}
     ]
-    game2 = TurtleSoupGame(puzzle, api_call, max_rounds=30, players_config=players_3)
+    game2 = TurtleSoupGame(puzzle, api_call, max_rounds=30, players_config=players_3, host=host)
     game2.run_game()
-    game2.save_game_log("experiment5_3players.json")
+    save2 = _IO_POOL.submit(game2.save_game_log, "experiment5_3players.json")
 
     # 4个玩家
     print("\n" + "=" * 60)
@@ -224,9 +308,11 @@ def experiment_player_count():
         {"name": "Player3", "strategy": "systematic"},
         {"name": "Player4", "strategy": "creative"}
     ]
-    game3 = TurtleSoupGame(puzzle, api_call, max_rounds=40, players_config=players_4)
+    game3 = TurtleSoupGame(puzzle, api_call, max_rounds=40, players_config=players_4, host=host)
     game3.run_game()
-    game3.save_game_log("experiment5_4players.json")
+    save3 = _IO_POOL.submit(game3.save_game_log, "experiment5_4players.json")
+
+    _wait_for_saves([save1, save2, save3])
 
 
 if __name__ == "__main__":
@@ -3,10 +3,42 @@
 负责协调主持人和玩家之间的交互，管理游戏流程
 """
 
-from typing import Dict, List, Callable, Optional
+from typing import Dict, List, Callable, Optional, Tuple
+import asyncio
 import json
+import logging
+import re
+import sys
+import time
 from datetime import datetime
+from types import MappingProxyType
 from agents import HostAgent, PlayerAgent
+from api_utils import call_model, call_model_async, estimate_tokens
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 游戏过程输出到日志（INFO级别）；批量运行时可将级别设为WARNING，不输出逐回合信息
+logger = logging.getLogger(__name__)
+
+_BANNER = "=" * 60
+_SECTION = "#" * 60
+
+
+# 以推理标记开头的玩家回复是推理而非提问（只检查开头，回复正文中提到的标记不算）
+_GUESS_RE = re.compile(r"^\s*\[(?:最终)?推理\]")
+
+# 压缩较早回合对话历史时使用的系统提示
+HISTORY_SUMMARY_SYSTEM_PROMPT = """你负责整理海龟汤游戏的问答记录。
+请把给出的问答压缩成一段不超过200字的摘要，保留所有已确认和已排除的事实，不要推测或添加新信息。只输出摘要本身。"""
+
+
+def _write_stdout(text: str):
+    """把流式生成的文本片段直接写到标准输出"""
+    sys.stdout.write(text)
+    sys.stdout.flush()
 
 
 class TurtleSoupGame:
@@ -19,7 +51,11 @@ class TurtleSoupGame:
         puzzle_data: Dict,
         model_api_call: Callable,
         max_rounds: int = 20,
-        players_config: Optional[List[Dict]] = None
+        players_config: Optional[List[Dict]] = None,
+        max_concurrency: int = 4,
+        host: Optional[HostAgent] = None,
+        host_api_call: Optional[Callable] = None,
+        history_token_budget: Optional[int] = 2000
     ):
         """
         初始化游戏
@@ -28,14 +64,25 @@ class TurtleSoupGame:
             puzzle_data: 谜题数据（包含surface、bottom、key_question等）
             model_api_call: 调用LLM的函数，签名为 func(system_prompt, user_prompt) -> str
             max_rounds: 最大回合数
-            players_config: 玩家配置，格式如 [{"name": "Player1", "strategy": "systematic"}, ...]
+            players_config: 玩家配置，格式如 [{"name": "Player1", "strategy": "systematic"}, ...]，
+                至少包含一个玩家
+            max_concurrency: 异步模式下同时进行的最大API调用数（用于遵守速率限制）
+            host: 预先创建的主持人（同一谜题的多局游戏可共用，不提供时根据puzzle_data创建）
+            host_api_call: 主持人专用的LLM调用函数（如本地小模型），不提供时使用model_api_call
+            history_token_budget: 传给玩家的对话历史的token上限。超过时把较早的一半回合压缩成摘要，
+                使每次调用的输入长度保持有界；为None时始终发送完整历史
         """
         self.puzzle_data = puzzle_data
         self.model_api_call = model_api_call
+        self.host_api_call = host_api_call if host_api_call is not None else model_api_call
         self.max_rounds = max_rounds
+        self.max_concurrency = max_concurrency
+        self.history_token_budget = history_token_budget
 
         # 初始化主持人
-        self.host = HostAgent(puzzle_data)
+        self.host = host if host is not None else HostAgent(puzzle_data)
+        # 本局已回答过的问题（主持人可能被多局游戏共用，重复提问的回答只在本局内沿用）
+        self._answered_questions: Dict[str, str] = {}
 
         # 初始化玩家
         if players_config is None:
@@ -43,13 +90,24 @@ class TurtleSoupGame:
                 {"name": "Player1", "strategy": "systematic"},
                 {"name": "Player2", "strategy": "creative"}
             ]
+        if not players_config:
+            raise ValueError("players_config至少需要包含一个玩家")
         self.players = [
-            PlayerAgent(config["name"], config.get("strategy", "systematic"))
+            PlayerAgent(config["name"], config.get("strategy", "systematic"), surface=puzzle_data["surface"])
             for config in players_config
         ]
+        self._player_names_str = ", ".join(p.player_name for p in self.players)
 
         # 游戏状态
+        # conversation_history保存完整的问答记录；其中前_summarized_rounds个回合已压缩进summary，
+        # 玩家看到的是get_effective_history()返回的摘要加之后的逐字回合
         self.conversation_history = []
+        self.summary: str = ""
+        self._summary_item: Optional[Dict] = None
+        self._summarized_rounds = 0
+        self._history_tokens = 0
+        # 计时起点：回合时间用单调时钟记录（不受系统时间调整影响），墙上时间只在开始和结束时各记一次
+        self._t0 = time.monotonic_ns()
         self.current_round = 0
         self.game_log = {
             "puzzle_index": puzzle_data.get("index", 0),
@@ -77,20 +135,17 @@ class TurtleSoupGame:
         player = self.players[player_idx]
 
         # 玩家提问
-        print(f"\n{'='*60}")
-        print(f"回合 {self.current_round + 1} - {player.player_name} 的回合")
-        print(f"{'='*60}")
+        logger.info("\n%s\n回合 %d - %s 的回合\n%s", _BANNER, self.current_round + 1, player.player_name, _BANNER)
 
         player_response = player.ask_question(
-            self.puzzle_data["surface"],
-            self.conversation_history,
+            self.get_effective_history(),
             self.model_api_call
         )
 
-        print(f"\n{player.player_name}: {player_response}")
+        logger.info("\n%s: %s", player.player_name, player_response)
 
         # 检查是否是推理而非提问
-        is_guess = "[推理]" in player_response or "[最终推理]" in player_response
+        is_guess = _GUESS_RE.match(player_response) is not None
 
         if is_guess:
             # 玩家给出了推理，不需要主持人回答
@@ -103,8 +158,10 @@ class TurtleSoupGame:
             }
         else:
             # 主持人回答
-            host_answer = self.host.answer_question(player_response, self.model_api_call)
-            print(f"主持人: {host_answer}")
+            host_answer = self.host.answer_question(
+                player_response, self.host_api_call, self._answered_questions
+            )
+            logger.info("主持人: %s", host_answer)
 
             round_info = {
                 "round": self.current_round + 1,
@@ -114,13 +171,171 @@ class TurtleSoupGame:
                 "is_guess": False
             }
 
-            self.conversation_history.append(round_info)
+            self._append_history(round_info)
 
+        round_info["t_ns"] = time.monotonic_ns() - self._t0
         self.game_log["rounds"].append(round_info)
         self.current_round += 1
 
+        if self._needs_summary():
+            user_prompt, folded = self._build_summary_prompt()
+            self._apply_summary(
+                call_model(self.model_api_call, HISTORY_SUMMARY_SYSTEM_PROMPT, user_prompt),
+                folded
+            )
+
         return round_info
 
+    async def play_round_batch(self, semaphore: asyncio.Semaphore) -> List[Dict]:
+        """
+        异步执行一批回合：所有玩家基于同一份对话历史并发提问，每个问题一生成完主持人就开始作答，
+        不必等待其他玩家（主持人作答与其他玩家的提问重叠进行）。本批次的回合在全部完成后按玩家顺序记录
+
+        Args:
+            semaphore: 限制并发API调用数的信号量
+
+        Returns:
+            本批次的回合信息列表（按玩家顺序）
+        """
+        players = self.players[:self.max_rounds - self.current_round]
+        history = self.get_effective_history()
+
+        logger.info(
+            "\n%s\n回合 %d-%d - %s 同时提问\n%s",
+            _BANNER,
+            self.current_round + 1,
+            self.current_round + len(players),
+            self._player_names_str if len(players) == len(self.players)
+            else ", ".join(p.player_name for p in players),
+            _BANNER
+        )
+
+        async def ask_and_answer(player: PlayerAgent) -> Tuple[str, Optional[str]]:
+            """一个玩家提问，再由主持人回答（推理不需要回答）"""
+            response = await self._bounded(semaphore, player.ask_question_async(history, self.model_api_call))
+            if _GUESS_RE.match(response) is not None:
+                return response, None
+            answer = await self._bounded(semaphore, self.host.answer_question_async(
+                response, self.host_api_call, self._answered_questions
+            ))
+            return response, answer
+
+        results = await asyncio.gather(*(ask_and_answer(p) for p in players))
+
+        batch = []
+        t_ns = time.monotonic_ns() - self._t0
+        for player, (response, answer) in zip(players, results):
+            logger.info("\n%s: %s", player.player_name, response)
+            is_guess = answer is None
+
+            round_info = {
+                "round": self.current_round + 1,
+                "player": player.player_name,
+                "question": response,
+                "answer": None,
+                "is_guess": is_guess,
+                "t_ns": t_ns
+            }
+            if not is_guess:
+                round_info["answer"] = answer
+                logger.info("主持人: %s", answer)
+                self._append_history(round_info)
+
+            self.game_log["rounds"].append(round_info)
+            self.current_round += 1
+            batch.append(round_info)
+
+        if self._needs_summary():
+            user_prompt, folded = self._build_summary_prompt()
+            async with semaphore:
+                summary = await call_model_async(self.model_api_call, HISTORY_SUMMARY_SYSTEM_PROMPT, user_prompt)
+            self._apply_summary(summary, folded)
+
+        return batch
+
+    @staticmethod
+    async def _bounded(semaphore: asyncio.Semaphore, coro):
+        """在信号量限制下等待协程"""
+        async with semaphore:
+            return await coro
+
+    @property
+    def answered_questions(self) -> MappingProxyType:
+        """本局已回答过的问题（规范化后的问题 -> 回答）的只读视图"""
+        return MappingProxyType(self._answered_questions)
+
+    def get_effective_history(self) -> List[Dict]:
+        """
+        返回传给玩家的对话历史：较早回合的摘要（如有）加上之后的逐字回合
+
+        Returns:
+            对话历史列表，摘要条目的格式为 {"role": "summary", "summary": ...}
+        """
+        recent = self.conversation_history[self._summarized_rounds:]
+        if self._summary_item is None:
+            return recent
+        return [self._summary_item] + recent
+
+    def _append_history(self, round_info: Dict):
+        """记录一轮问答并累计其token数"""
+        self.conversation_history.append(round_info)
+        self._history_tokens += estimate_tokens(round_info["question"] + round_info["answer"])
+
+    def _needs_summary(self) -> bool:
+        """逐字历史是否超过了token上限（至少保留两个回合才值得压缩）"""
+        return (
+            self.history_token_budget is not None
+            and self._history_tokens > self.history_token_budget
+            and len(self.conversation_history) - self._summarized_rounds >= 2
+        )
+
+    def _build_summary_prompt(self) -> Tuple[str, int]:
+        """
+        构建压缩较早一半逐字回合的用户提示
+
+        Returns:
+            (用户提示, 被压缩的回合数)
+        """
+        recent = self.conversation_history[self._summarized_rounds:]
+        folded = len(recent) // 2
+        lines = "\n".join(
+            f"{item['player']}: {item['question']}\n主持人: {item['answer']}"
+            for item in recent[:folded]
+        )
+        previous = f"**已有摘要：**\n{self.summary}\n\n" if self.summary else ""
+        return f"{previous}**新的问答：**\n{lines}\n\n请输出合并后的摘要。", folded
+
+    def _apply_summary(self, summary: str, folded: int):
+        """用新摘要替换被压缩的回合，并重新计算逐字历史的token数"""
+        self.summary = summary.strip()
+        # 每次生成新的摘要条目，玩家据此识别历史已变化并重新渲染
+        self._summary_item = {"role": "summary", "summary": self.summary}
+        self._summarized_rounds += folded
+        self._history_tokens = estimate_tokens(self.summary) + sum(
+            estimate_tokens(item["question"] + item["answer"])
+            for item in self.conversation_history[self._summarized_rounds:]
+        )
+
+    def _print_game_start(self):
+        """输出游戏开场信息"""
+        logger.info(
+            "\n%s\n海龟汤游戏开始！\n%s\n\n汤面：%s\n\n玩家：%s\n最大回合数：%d",
+            _SECTION,
+            _SECTION,
+            self.puzzle_data["surface"],
+            self._player_names_str,
+            self.max_rounds
+        )
+
+    def _reveal_truth(self):
+        """揭晓真相并记录结束信息"""
+        logger.info("\n%s\n真相揭晓！\n%s\n\n%s", _SECTION, _SECTION, self.puzzle_data["bottom"])
+
+        # 记录结束时间
+        self.game_log["end_time"] = datetime.now().isoformat()
+        self.game_log["duration_ns"] = time.monotonic_ns() - self._t0
+        self.game_log["total_rounds"] = self.current_round
+
     def run_game(self) -> Dict:
         """
         运行完整游戏
@@ -128,12 +343,7 @@ class TurtleSoupGame:
         Returns:
             游戏日志
         """
-        print(f"\n{'#'*60}")
-        print("海龟汤游戏开始！")
-        print(f"{'#'*60}")
-        print(f"\n汤面：{self.puzzle_data['surface']}")
-        print(f"\n玩家：{', '.join([p.player_name for p in self.players])}")
-        print(f"最大回合数：{self.max_rounds}")
+        self._print_game_start()
 
         # 游戏主循环
         player_idx = 0
@@ -144,7 +354,7 @@ class TurtleSoupGame:
 
             # 检查是否有玩家给出了推理
             if round_info.get("is_guess", False):
-                print(f"\n{self.players[player_idx].player_name} 给出了推理！")
+                logger.info("\n%s 给出了推理！", self.players[player_idx].player_name)
                 game_ended = True
                 break
 
@@ -152,29 +362,66 @@ class TurtleSoupGame:
             player_idx = (player_idx + 1) % len(self.players)
 
         # 游戏结束，让所有玩家给出最终推理
-        print(f"\n{'#'*60}")
-        print("游戏结束！请各位玩家给出最终推理")
-        print(f"{'#'*60}")
+        logger.info("\n%s\n游戏结束！请各位玩家给出最终推理\n%s", _SECTION, _SECTION)
 
+        # 输出INFO级别日志时以流式方式边生成边显示，否则直接等待完整的推理
+        on_token = _write_stdout if logger.isEnabledFor(logging.INFO) else None
         for player in self.players:
+            logger.info("\n%s 的最终推理：", player.player_name)
             final_guess = player.make_final_guess(
-                self.puzzle_data["surface"],
-                self.conversation_history,
-                self.model_api_call
+                self.get_effective_history(),
+                self.model_api_call,
+                on_token=on_token
             )
-            print(f"\n{player.player_name} 的最终推理：")
-            print(final_guess)
+            if on_token is not None:
+                _write_stdout("\n")
             self.game_log["final_guesses"][player.player_name] = final_guess
 
         # 显示真相
-        print(f"\n{'#'*60}")
-        print("真相揭晓！")
-        print(f"{'#'*60}")
-        print(f"\n{self.puzzle_data['bottom']}")
+        self._reveal_truth()
 
-        # 记录结束时间
-        self.game_log["end_time"] = datetime.now().isoformat()
-        self.game_log["total_rounds"] = self.current_round
+        return self.game_log
+
+    async def run_game_async(self) -> Dict:
+        """
+        异步运行完整游戏，每批次内所有玩家并发提问
+
+        Returns:
+            游戏日志
+        """
+        self._print_game_start()
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # 游戏主循环
+        while self.current_round < self.max_rounds:
+            batch = await self.play_round_batch(semaphore)
+
+            # 检查是否有玩家给出了推理
+            guessers = [info["player"] for info in batch if info["is_guess"]]
+            if guessers:
+                logger.info("\n%s 给出了推理！", ", ".join(guessers))
+                break
+
+        # 游戏结束，让所有玩家给出最终推理
+        logger.info("\n%s\n游戏结束！请各位玩家给出最终推理\n%s", _SECTION, _SECTION)
+
+        # 各玩家的最终推理互不依赖，并发生成后按玩家顺序输出
+        history = self.get_effective_history()
+        final_guesses = await asyncio.gather(*(
+            self._bounded(semaphore, player.make_final_guess_async(
+                history,
+                self.model_api_call
+            ))
+            for player in self.players
+        ))
+
+        for player, final_guess in zip(self.players, final_guesses):
+            logger.info("\n%s 的最终推理：\n%s", player.player_name, final_guess)
+            self.game_log["final_guesses"][player.player_name] = final_guess
+
+        # 显示真相
+        self._reveal_truth()
 
         return self.game_log
 
@@ -182,9 +429,19 @@ class TurtleSoupGame:
         """
         保存游戏日志到文件
 
+        游戏过程中日志只保存在内存里，在这里一次性序列化（不要在每回合写文件，否则总写入量随回合数平方增长）；
+        安装了orjson时使用更快的orjson
+
         Args:
             filepath: 保存路径
         """
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(self.game_log, f, ensure_ascii=False, indent=2)
-        print(f"\n游戏日志已保存到: {filepath}")
+        if orjson is not None:
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(
+                    self.game_log,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+                ))
+        else:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(self.game_log, f, ensure_ascii=False, indent=2)
+        logger.info("\n游戏日志已保存到: %s", filepath)
@@ -3,17 +3,81 @@
 支持使用OpenAI API、Anthropic API或其他LLM服务
 """
 
+import argparse
+import asyncio
+import atexit
+import functools
+import hashlib
+import importlib.util
+import inspect
+import itertools
 import json
+import logging
 import os
-from typing import Dict, Callable
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+from api_utils import ResponseCache, aclose_models, call_model_async, guard_requests, per_event_loop
 from game_controller import TurtleSoupGame
 from evaluator import GameEvaluator
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 超过该大小且安装了ijson时，只取单个谜题时流式解析文件，不把整个文件读入内存
+_STREAM_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=1)
+def _parse_puzzle_file(json_path: str, mtime_ns: int) -> List[Dict]:
+    """解析整个谜题文件；缓存以(路径, 修改时间)为键，文件被修改后会重新解析"""
+    with open(json_path, 'rb') as f:
+        content = f.read()
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def load_puzzles(json_path: str = "test.json") -> List[Dict]:
+    """
+    加载JSON文件中的全部谜题
+
+    安装了orjson时使用更快的orjson解析；同一文件未修改时重复调用直接返回上次的结果
+    （返回的列表是共享的，调用方不应修改）
+
+    Args:
+        json_path: JSON文件路径
+
+    Returns:
+        谜题数据字典的列表
+    """
+    return _parse_puzzle_file(json_path, os.stat(json_path).st_mtime_ns)
+
+
+def _stream_puzzle(json_path: str, puzzle_index: int) -> Dict:
+    """用ijson逐个解析谜题，只构造到第puzzle_index个为止"""
+    import ijson
+
+    with open(json_path, 'rb') as f:
+        count = 0
+        for count, puzzle in enumerate(ijson.items(f, 'item', use_float=True), start=1):
+            if count - 1 == puzzle_index:
+                return puzzle
+    raise ValueError(f"谜题索引 {puzzle_index} 超出范围（共有 {count} 个谜题）")
+
 
 def load_puzzle_data(json_path: str, puzzle_index: int = 0) -> Dict:
     """
     从JSON文件加载谜题数据
 
+    通常复用load_puzzles解析的结果；文件很大且安装了ijson时改为流式解析，
+    只读到所需的谜题为止，避免整个文件常驻内存
+
     Args:
         json_path: JSON文件路径
         puzzle_index: 谜题索引（默认为0，即第一个谜题）
@@ -21,28 +85,92 @@ def load_puzzle_data(json_path: str, puzzle_index: int = 0) -> Dict:
     Returns:
         谜题数据字典
     """
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    if os.path.getsize(json_path) > _STREAM_THRESHOLD_BYTES and importlib.util.find_spec("ijson") is not None:
+        return _stream_puzzle(json_path, puzzle_index)
 
+    data = load_puzzles(json_path)
     if puzzle_index >= len(data):
         raise ValueError(f"谜题索引 {puzzle_index} 超出范围（共有 {len(data)} 个谜题）")
 
     return data[puzzle_index]
 
 
-def create_openai_api_call(api_key: str = None, model: str = "gpt-4") -> Callable:
+def _pooled_http_client(async_client: bool = False):
+    """
+    创建带连接池的httpx客户端（httpx是openai/anthropic库自带的依赖）
+
+    保持长连接以免每次请求都重新进行TCP/TLS握手；安装了h2时启用HTTP/2，
+    并发请求可在同一条连接上多路复用
+
+    Args:
+        async_client: 是否创建httpx.AsyncClient
+
+    Returns:
+        httpx.Client或httpx.AsyncClient
+    """
+    import httpx
+
+    client_cls = httpx.AsyncClient if async_client else httpx.Client
+    return client_cls(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+
+
+def _stream_openai_text(response):
+    """逐段产出OpenAI流式响应的文本；调用方提前停止读取时关闭连接，不再接收（和计费）后续内容"""
+    try:
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        response.close()
+
+
+async def _astream_openai_text(response):
+    """_stream_openai_text 的异步版本"""
+    try:
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await response.close()
+
+
+def create_openai_api_call(
+    api_key: str = None,
+    model: str = "gpt-4",
+    cache_path: str = None,
+    max_retries: int = 5,
+    max_concurrent: int = None,
+    rpm: float = None,
+    structured_output: bool = False
+) -> Callable:
     """
     创建OpenAI API调用函数
 
+    返回的函数本身是同步的；其acall属性是使用AsyncOpenAI的异步版本，
+    在异步游戏流程中会被优先使用。两者都通过带连接池的httpx客户端复用连接，
+    异步客户端需在事件循环结束前用aclose_models关闭，同步客户端在程序退出时关闭
+
     Args:
         api_key: OpenAI API密钥（如果不提供，会从环境变量OPENAI_API_KEY读取）
         model: 模型名称
+        cache_path: 响应缓存的SQLite文件路径；提供时相同请求直接返回缓存结果，
+            且默认温度改为0以保证缓存结果与重新调用一致
+        max_retries: 遇到限流、连接错误或服务端错误时的最大重试次数
+            （安装了tenacity时以指数退避加随机抖动重试，否则交给SDK自带的重试）
+        max_concurrent: 同时进行的最大请求数，用于主动遵守速率限制而不是依赖429错误退避
+        rpm: 每分钟最多请求数（同步和异步调用共用额度，重试的每次尝试也计入）
+        structured_output: 是否对response_schema启用JSON Schema结构化输出（需要模型支持，
+            如gpt-4o及之后的模型；gpt-4等不支持的模型会返回400错误）。默认关闭，
+            玩家以带格式标记的文本回复，并可流式读取、在提问行结束后提前停止
 
     Returns:
         API调用函数
     """
     try:
-        from openai import OpenAI
+        from openai import APIConnectionError, AsyncOpenAI, InternalServerError, OpenAI, RateLimitError
     except ImportError:
         raise ImportError("请先安装OpenAI库: pip install openai")
 
@@ -51,36 +179,340 @@ def create_openai_api_call(api_key: str = None, model: str = "gpt-4") -> Callabl
         if not api_key:
             raise ValueError("请提供OpenAI API密钥或设置环境变量OPENAI_API_KEY")
 
-    client = OpenAI(api_key=api_key)
+    guard = guard_requests(
+        (RateLimitError, APIConnectionError, InternalServerError),
+        max_attempts=max_retries + 1,
+        max_concurrent=max_concurrent,
+        rpm=rpm
+    )
+    sdk_retries = 0 if guard.retries else max_retries
+    client = OpenAI(api_key=api_key, http_client=_pooled_http_client(), max_retries=sdk_retries)
+    atexit.register(client.close)
+    get_async_client = per_event_loop(lambda: AsyncOpenAI(
+        api_key=api_key,
+        http_client=_pooled_http_client(async_client=True),
+        max_retries=sdk_retries
+    ))
+
+    @guard
+    def create(**request):
+        return client.chat.completions.create(**request)
 
-    def api_call(system_prompt: str, user_prompt: str) -> str:
-        """调用OpenAI API"""
-        response = client.chat.completions.create(
+    @guard
+    async def create_async(**request):
+        return await get_async_client().chat.completions.create(**request)
+    default_temperature = 0 if cache_path else 0.7
+
+    def build_request(
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int,
+        stop: list,
+        temperature: float,
+        response_schema: Dict = None
+    ) -> Dict:
+        """构建请求参数"""
+        request = dict(
             model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
-            temperature=0.7
+            temperature=temperature,
+            # 相同系统提示的请求路由到同一缓存，提高自动前缀缓存的命中率
+            extra_body={"prompt_cache_key": hashlib.blake2b(
+                system_prompt.encode("utf-8"), digest_size=16
+            ).hexdigest()}
         )
+        if max_tokens is not None:
+            request["max_tokens"] = max_tokens
+        if stop:
+            request["stop"] = stop
+        if structured_output and response_schema is not None:
+            request["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": response_schema["name"],
+                    "schema": response_schema["schema"],
+                    "strict": True
+                }
+            }
+        return request
+
+    def api_call(
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = None,
+        stop: list = None,
+        temperature: float = default_temperature,
+        stream: bool = False,
+        response_schema: Dict = None
+    ):
+        """
+        调用OpenAI API（stream=True时返回逐段文本的迭代器；
+        启用structured_output且给出response_schema时回复为符合该结构的JSON）
+        """
+        request = build_request(system_prompt, user_prompt, max_tokens, stop, temperature, response_schema)
+        if stream:
+            return _stream_openai_text(create(stream=True, **request))
+
+        response = create(**request)
+        return response.choices[0].message.content
+
+    async def api_call_async(
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = None,
+        stop: list = None,
+        temperature: float = default_temperature,
+        stream: bool = False,
+        response_schema: Dict = None
+    ):
+        """异步调用OpenAI API（stream=True时返回逐段文本的异步迭代器）"""
+        request = build_request(system_prompt, user_prompt, max_tokens, stop, temperature, response_schema)
+        if stream:
+            return _astream_openai_text(await create_async(stream=True, **request))
+
+        response = await create_async(**request)
         return response.choices[0].message.content
 
+    api_call.acall = api_call_async
+    api_call.aclose = get_async_client.aclose
+    if cache_path:
+        return ResponseCache(cache_path, namespace=f"openai:{model}:{default_temperature}").wrap(api_call)
+    return api_call
+
+
+def create_openai_batch_api_call(
+    api_key: str = None,
+    model: str = "gpt-4",
+    temperature: float = 0,
+    max_batch_size: int = 1000,
+    flush_interval: float = 5.0,
+    poll_interval: float = 30.0
+) -> Callable:
+    """
+    创建通过OpenAI Batch API调用的函数（费用为实时接口的一半，24小时内完成）
+
+    适合不需要实时结果的离线任务，如批量评估已完成的游戏。调用会阻塞到结果返回：
+    在flush_interval秒内到达的请求（如多个线程同时评估不同的游戏）合并成一个批次提交，
+    提交后每poll_interval秒查询一次状态，完成后把结果分发给各个调用方
+
+    Args:
+        api_key: OpenAI API密钥（如果不提供，会从环境变量OPENAI_API_KEY读取）
+        model: 模型名称
+        temperature: 默认温度
+        max_batch_size: 单个批次的最大请求数，达到后立即提交
+        flush_interval: 第一个请求到达后等待合并其他请求的秒数
+        poll_interval: 查询批次状态的间隔秒数
+
+    Returns:
+        API调用函数（其acall属性为异步版本）
+    """
+    try:
+        from openai import OpenAI
+    except ImportError:
+        raise ImportError("请先安装OpenAI库: pip install openai")
+
+    if api_key is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("请提供OpenAI API密钥或设置环境变量OPENAI_API_KEY")
+
+    client = OpenAI(api_key=api_key)
+    request_ids = itertools.count()
+    pending = []  # (custom_id, 请求体, Future)
+    lock = threading.Lock()
+    timer = [None]
+
+    def run_batch(requests: list):
+        """提交一个批次并等待完成，再把结果写入对应的Future"""
+        futures = {custom_id: future for custom_id, _, future in requests}
+        try:
+            lines = [
+                json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": body
+                }, ensure_ascii=False)
+                for custom_id, body, _ in requests
+            ]
+            input_file = client.files.create(
+                file=("batch.jsonl", "\n".join(lines).encode("utf-8")),
+                purpose="batch"
+            )
+            batch = client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(poll_interval)
+                batch = client.batches.retrieve(batch.id)
+
+            if batch.output_file_id:
+                for line in client.files.content(batch.output_file_id).text.splitlines():
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    future = futures.pop(result["custom_id"], None)
+                    if future is None:
+                        continue
+                    response = result.get("response") or {}
+                    if response.get("status_code") == 200:
+                        future.set_result(response["body"]["choices"][0]["message"]["content"])
+                    else:
+                        future.set_exception(RuntimeError(f"批处理请求失败: {result.get('error') or response}"))
+
+            for future in futures.values():
+                future.set_exception(RuntimeError(f"批次 {batch.id} 未返回该请求的结果（状态: {batch.status}）"))
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def flush():
+        """把当前缓冲的请求作为一个批次在后台提交"""
+        with lock:
+            requests = pending[:]
+            pending.clear()
+            if timer[0] is not None:
+                timer[0].cancel()
+                timer[0] = None
+        if requests:
+            threading.Thread(target=run_batch, args=(requests,), daemon=True).start()
+
+    def submit(system_prompt: str, user_prompt: str, max_tokens: int, stop: list, temperature: float) -> Future:
+        """缓冲一个请求，返回其结果的Future"""
+        body = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": temperature
+        }
+        if max_tokens is not None:
+            body["max_tokens"] = max_tokens
+        if stop:
+            body["stop"] = stop
+
+        future = Future()
+        with lock:
+            pending.append((f"request-{next(request_ids)}", body, future))
+            full = len(pending) >= max_batch_size
+            if not full and timer[0] is None:
+                timer[0] = threading.Timer(flush_interval, flush)
+                timer[0].daemon = True
+                timer[0].start()
+        if full:
+            flush()
+        return future
+
+    def api_call(
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = None,
+        stop: list = None,
+        temperature: float = temperature
+    ) -> str:
+        """通过Batch API调用（阻塞到批次完成）"""
+        return submit(system_prompt, user_prompt, max_tokens, stop, temperature).result()
+
+    async def api_call_async(
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = None,
+        stop: list = None,
+        temperature: float = temperature
+    ) -> str:
+        """通过Batch API异步调用"""
+        return await asyncio.wrap_future(submit(system_prompt, user_prompt, max_tokens, stop, temperature))
+
+    api_call.acall = api_call_async
     return api_call
 
 
-def create_anthropic_api_call(api_key: str = None, model: str = "claude-3-5-sonnet-20241022") -> Callable:
+def _build_anthropic_user_content(user_prompt: str, prefix_blocks: list = None):
+    """
+    构建Anthropic用户消息的内容
+
+    如果给出了prefix_blocks（拼接后为user_prompt的开头，如逐回合的对话历史），
+    将其拆成独立的文本块并在最后一块上标记缓存断点：下一回合只在末尾追加新块，
+    之前的前缀可以直接命中缓存
+    """
+    prefix = "".join(prefix_blocks or [])
+    if not prefix or not user_prompt.startswith(prefix):
+        return user_prompt
+
+    content = [{"type": "text", "text": block} for block in prefix_blocks]
+    content[-1]["cache_control"] = {"type": "ephemeral"}
+    rest = user_prompt[len(prefix):]
+    if rest.strip():
+        content.append({"type": "text", "text": rest})
+    return content
+
+
+def _stream_anthropic_text(response):
+    """逐段产出Anthropic流式响应（事件流）中的文本；调用方提前停止读取时关闭连接"""
+    try:
+        for event in response:
+            if event.type == "content_block_delta" and event.delta.type == "text_delta":
+                yield event.delta.text
+    finally:
+        response.close()
+
+
+async def _astream_anthropic_text(response):
+    """_stream_anthropic_text 的异步版本"""
+    try:
+        async for event in response:
+            if event.type == "content_block_delta" and event.delta.type == "text_delta":
+                yield event.delta.text
+    finally:
+        await response.close()
+
+
+def _anthropic_response_text(response) -> str:
+    """取出Anthropic回复的文本；强制调用工具（结构化输出）时返回工具参数的JSON"""
+    for block in response.content:
+        if block.type == "tool_use":
+            return json.dumps(block.input, ensure_ascii=False)
+    return response.content[0].text
+
+
+def create_anthropic_api_call(
+    api_key: str = None,
+    model: str = "claude-3-5-sonnet-20241022",
+    cache_path: str = None,
+    max_retries: int = 5,
+    max_concurrent: int = None,
+    rpm: float = None,
+    structured_output: bool = False
+) -> Callable:
     """
     创建Anthropic API调用函数
 
+    返回的函数本身是同步的；其acall属性是使用AsyncAnthropic的异步版本，
+    在异步游戏流程中会被优先使用。连接的复用与关闭同create_openai_api_call
+
     Args:
         api_key: Anthropic API密钥（如果不提供，会从环境变量ANTHROPIC_API_KEY读取）
         model: 模型名称
+        cache_path: 响应缓存的SQLite文件路径；提供时相同请求直接返回缓存结果，
+            且默认温度改为0以保证缓存结果与重新调用一致
+        max_retries: 遇到限流、连接错误或服务端错误时的最大重试次数（同create_openai_api_call）
+        max_concurrent: 同时进行的最大请求数
+        rpm: 每分钟最多请求数（同create_openai_api_call）
+        structured_output: 是否对response_schema启用强制工具调用形式的结构化输出。
+            默认关闭；开启后带response_schema的请求不使用流式
 
     Returns:
         API调用函数
     """
     try:
-        from anthropic import Anthropic
+        from anthropic import Anthropic, APIConnectionError, AsyncAnthropic, InternalServerError, RateLimitError
     except ImportError:
         raise ImportError("请先安装Anthropic库: pip install anthropic")
 
@@ -89,79 +521,331 @@ def create_anthropic_api_call(api_key: str = None, model: str = "claude-3-5-sonn
         if not api_key:
             raise ValueError("请提供Anthropic API密钥或设置环境变量ANTHROPIC_API_KEY")
 
-    client = Anthropic(api_key=api_key)
+    guard = guard_requests(
+        (RateLimitError, APIConnectionError, InternalServerError),
+        max_attempts=max_retries + 1,
+        max_concurrent=max_concurrent,
+        rpm=rpm
+    )
+    sdk_retries = 0 if guard.retries else max_retries
+    client = Anthropic(api_key=api_key, http_client=_pooled_http_client(), max_retries=sdk_retries)
+    atexit.register(client.close)
+    get_async_client = per_event_loop(lambda: AsyncAnthropic(
+        api_key=api_key,
+        http_client=_pooled_http_client(async_client=True),
+        max_retries=sdk_retries
+    ))
+
+    @guard
+    def create(**request):
+        return client.messages.create(**request)
+
+    @guard
+    async def create_async(**request):
+        return await get_async_client().messages.create(**request)
 
-    def api_call(system_prompt: str, user_prompt: str) -> str:
-        """调用Anthropic API"""
-        response = client.messages.create(
+    default_temperature = 0 if cache_path else 0.7
+
+    def build_request(
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int,
+        stop: list,
+        temperature: float,
+        prefix_blocks: list = None,
+        response_schema: Dict = None
+    ) -> Dict:
+        """构建请求参数"""
+        request = dict(
             model=model,
-            max_tokens=1024,
-            system=system_prompt,
+            max_tokens=max_tokens,
+            # 系统提示在整局游戏中不变，标记为可缓存以避免重复预填充
+            system=[{
+                "type": "text",
+                "text": system_prompt,
+                "cache_control": {"type": "ephemeral"}
+            }],
             messages=[
+                {"role": "user", "content": _build_anthropic_user_content(user_prompt, prefix_blocks)}
+            ],
+            temperature=temperature
+        )
+        # Anthropic不接受纯空白的停止序列
+        stop_sequences = [seq for seq in (stop or []) if seq.strip()]
+        if stop_sequences:
+            request["stop_sequences"] = stop_sequences
+        if structured_output and response_schema is not None:
+            # 以强制调用工具的方式得到符合结构的输出
+            request["tools"] = [{
+                "name": response_schema["name"],
+                "description": response_schema.get("description", ""),
+                "input_schema": response_schema["schema"]
+            }]
+            request["tool_choice"] = {"type": "tool", "name": response_schema["name"]}
+        return request
+
+    def api_call(
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = 1024,
+        stop: list = None,
+        temperature: float = default_temperature,
+        stream: bool = False,
+        prefix_blocks: list = None,
+        response_schema: Dict = None
+    ):
+        """
+        调用Anthropic API（stream=True时返回逐段文本的迭代器；
+        启用structured_output且给出response_schema时回复为符合该结构的JSON，此时不使用流式）
+        """
+        request = build_request(
+            system_prompt, user_prompt, max_tokens, stop, temperature, prefix_blocks, response_schema
+        )
+        if stream and "tools" not in request:
+            return _stream_anthropic_text(create(stream=True, **request))
+
+        response = create(**request)
+        return _anthropic_response_text(response)
+
+    async def api_call_async(
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = 1024,
+        stop: list = None,
+        temperature: float = default_temperature,
+        stream: bool = False,
+        prefix_blocks: list = None,
+        response_schema: Dict = None
+    ):
+        """异步调用Anthropic API（stream=True时返回逐段文本的异步迭代器）"""
+        request = build_request(
+            system_prompt, user_prompt, max_tokens, stop, temperature, prefix_blocks, response_schema
+        )
+        if stream and "tools" not in request:
+            return _astream_anthropic_text(await create_async(stream=True, **request))
+
+        response = await create_async(**request)
+        return _anthropic_response_text(response)
+
+    api_call.acall = api_call_async
+    api_call.aclose = get_async_client.aclose
+    if cache_path:
+        return ResponseCache(cache_path, namespace=f"anthropic:{model}:{default_temperature}").wrap(api_call)
+    return api_call
+
+
+def create_local_api_call(
+    model_name: str = "Qwen/Qwen2.5-1.5B-Instruct",
+    load_in_8bit: bool = False,
+    device_map: str = "auto"
+) -> Callable:
+    """
+    创建本地模型API调用函数（例如为主持人蒸馏/微调的小模型）
+
+    主持人每回合都要回答，且只需输出"是"/"否"/"不重要"，
+    可通过TurtleSoupGame的host_api_call参数单独交给本地小模型处理
+
+    Args:
+        model_name: transformers模型名称或本地路径（如LoRA合并后的模型目录）
+        load_in_8bit: 是否使用bitsandbytes进行int8量化加载
+        device_map: 模型放置的设备
+
+    Returns:
+        API调用函数
+    """
+    try:
+        import torch
+        from transformers import pipeline
+    except ImportError:
+        raise ImportError("请先安装transformers和torch: pip install transformers torch")
+
+    model_kwargs = {}
+    if load_in_8bit:
+        try:
+            from transformers import BitsAndBytesConfig
+        except ImportError:
+            raise ImportError("请先安装bitsandbytes库: pip install bitsandbytes")
+        model_kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+
+    generator = pipeline(
+        "text-generation",
+        model=model_name,
+        torch_dtype=torch.bfloat16,
+        device_map=device_map,
+        model_kwargs=model_kwargs
+    )
+
+    def api_call(
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int = 1024,
+        stop: list = None,
+        temperature: float = 0.7
+    ) -> str:
+        """调用本地模型"""
+        do_sample = temperature > 0
+        outputs = generator(
+            [
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
-            temperature=0.7
+            max_new_tokens=max_tokens,
+            do_sample=do_sample,
+            temperature=temperature if do_sample else None,
+            return_full_text=False
         )
-        return response.content[0].text
+        text = outputs[0]["generated_text"]
+
+        # 截断到第一个停止序列
+        for seq in stop or []:
+            pos = text.find(seq)
+            if pos != -1:
+                text = text[:pos]
+        return text
 
     return api_call
 
 
+def create_local_embedding_fn(model_name: str = "sentence-transformers/all-MiniLM-L6-v2") -> Callable:
+    """
+    创建本地向量化函数（用于语义缓存）
+
+    Args:
+        model_name: sentence-transformers模型名称
+
+    Returns:
+        向量化函数，签名为 func(texts: List[str]) -> 向量数组
+    """
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise ImportError("请先安装sentence-transformers库: pip install sentence-transformers")
+
+    model = SentenceTransformer(model_name)
+
+    def embed(texts: list):
+        """本地计算向量"""
+        return model.encode(texts, normalize_embeddings=True)
+
+    return embed
+
+
+def create_openai_embedding_fn(api_key: str = None, model: str = "text-embedding-3-small") -> Callable:
+    """
+    创建OpenAI向量化函数（用于语义缓存）
+
+    Args:
+        api_key: OpenAI API密钥（如果不提供，会从环境变量OPENAI_API_KEY读取）
+        model: 向量模型名称
+
+    Returns:
+        向量化函数，签名为 func(texts: List[str]) -> 向量列表
+    """
+    try:
+        from openai import OpenAI
+    except ImportError:
+        raise ImportError("请先安装OpenAI库: pip install openai")
+
+    if api_key is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("请提供OpenAI API密钥或设置环境变量OPENAI_API_KEY")
+
+    client = OpenAI(api_key=api_key)
+
+    def embed(texts: list):
+        """调用OpenAI Embeddings API"""
+        response = client.embeddings.create(model=model, input=texts)
+        return [item.embedding for item in response.data]
+
+    return embed
+
+
+# 模拟API的固定响应（模块加载时构建一次，避免每次调用重复创建）
+_MOCK_HOST_RESPONSES = ("是。", "否。", "不重要。")
+_MOCK_PLAYER_QUESTIONS = (
+    "[提问] 这个人真的死了吗？",
+    "[提问] 他是故意假死的吗？",
+    "[提问] 他去了一个偏远的地方吗？",
+    "[提问] 他有什么目的吗？"
+)
+_MOCK_FINAL_GUESS = "[最终推理] 这个人假装自己死了，实际上逃到了一个偏远的岛屿，后来给家人寄了一封信。"
+_MOCK_EVALUATION = "核心情节：7/10\n关键细节：6/10\n逻辑推理：8/10\n整体完整度：7/10\n总体评分：70/100"
+
+
+def _mock_pick(responses: tuple, prompt: str) -> str:
+    """根据提示内容的哈希选出一个模拟响应（同样的输入总是得到同样的响应，与调用顺序无关）"""
+    digest = hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).digest()
+    return responses[int.from_bytes(digest, "big") % len(responses)]
+
+
 def create_mock_api_call() -> Callable:
     """
     创建模拟API调用函数（用于测试，不调用真实API）
 
+    响应由提示内容决定而不依赖共享的调用计数，并发调用时结果同样可复现
+
     Returns:
         模拟API调用函数
     """
-    call_count = [0]  # 使用列表来保持可变性
-
     def mock_call(system_prompt: str, user_prompt: str) -> str:
         """模拟API调用"""
-        call_count[0] += 1
-
         # 根据提示内容返回不同的模拟响应
         if "主持人" in system_prompt:
             # 模拟主持人回答
-            responses = ["是。", "否。", "不重要。"]
-            return responses[call_count[0] % 3]
+            return _mock_pick(_MOCK_HOST_RESPONSES, user_prompt)
         elif "玩家" in system_prompt:
             # 模拟玩家提问
             if "最终推理" in user_prompt:
-                return "[最终推理] 这个人假装自己死了，实际上逃到了一个偏远的岛屿，后来给家人寄了一封信。"
+                return _MOCK_FINAL_GUESS
             else:
-                questions = [
-                    "[提问] 这个人真的死了吗？",
-                    "[提问] 他是故意假死的吗？",
-                    "[提问] 他去了一个偏远的地方吗？",
-                    "[提问] 他有什么目的吗？"
-                ]
-                return questions[call_count[0] % len(questions)]
+                return _mock_pick(_MOCK_PLAYER_QUESTIONS, user_prompt)
         else:
             # 其他情况（如评估）
-            return "核心情节：7/10\n关键细节：6/10\n逻辑推理：8/10\n整体完整度：7/10\n总体评分：70/100"
+            return _MOCK_EVALUATION
 
     return mock_call
 
 
-def run_single_game(
+def _blocking_call(model_api_call: Callable, loop: asyncio.AbstractEventLoop) -> Callable:
+    """
+    把async def定义的API调用函数包装为同步函数：协程提交到loop中执行，调用线程阻塞等待结果
+
+    供在线程池中运行的同步代码（如评估）使用；不能在loop所在的线程中调用。同步函数原样返回
+    """
+    if not inspect.iscoroutinefunction(model_api_call):
+        return model_api_call
+
+    @functools.wraps(model_api_call)
+    def blocking_call(system_prompt: str, user_prompt: str, **options) -> str:
+        return asyncio.run_coroutine_threadsafe(
+            call_model_async(model_api_call, system_prompt, user_prompt, **options), loop
+        ).result()
+
+    return blocking_call
+
+
+async def run_single_game_async(
     puzzle_data: Dict,
     model_api_call: Callable,
     max_rounds: int = 20,
     players_config: list = None,
     save_log: bool = True,
-    log_path: str = None
+    log_path: str = None,
+    embed_fn: Callable = None,
+    host_api_call: Callable = None,
+    evaluator_api_call: Callable = None,
+    evaluation_cache: ResponseCache = None,
+    print_report: bool = True
 ) -> Dict:
     """
-    运行单个游戏
+    在当前事件循环中运行单个游戏（参数同run_single_game）
 
-    Args:
-        puzzle_data: 谜题数据
-        model_api_call: LLM API调用函数
-        max_rounds: 最大回合数
-        players_config: 玩家配置
-        save_log: 是否保存游戏日志
-        log_path: 日志保存路径
+    print_report为False时不输出评估进度和报告，供同时运行多局的调用方在全部结束后按顺序输出
+    （见GameEvaluator.format_report），以免各局的输出交错
+
+    游戏本身以异步方式运行；评估和保存日志是同步操作，放到线程池中执行以免阻塞同时进行的其他游戏。
+    不会关闭API调用函数的异步客户端，由调用方在事件循环结束前关闭（见aclose_models）
 
     Returns:
         游戏日志（包含评估结果）
@@ -171,16 +855,28 @@ def run_single_game(
         puzzle_data=puzzle_data,
         model_api_call=model_api_call,
         max_rounds=max_rounds,
-        players_config=players_config
+        players_config=players_config,
+        host_api_call=host_api_call
     )
 
-    # 运行游戏
-    game_log = game.run_game()
+    # 运行游戏（每批次内所有玩家并发提问）
+    game_log = await game.run_game_async()
+
+    # 评估游戏（评估器是同步的，异步的API调用函数通过当前事件循环执行）
+    evaluator_call = _blocking_call(evaluator_api_call or model_api_call, asyncio.get_running_loop())
+
+    def evaluate():
+        evaluator = GameEvaluator(
+            game_log,
+            evaluator_call,
+            embed_fn=embed_fn,
+            result_cache=evaluation_cache
+        )
+        evaluator.evaluate_all(verbose=print_report)
+        if print_report:
+            evaluator.print_detailed_report()
 
-    # 评估游戏
-    evaluator = GameEvaluator(game_log, model_api_call)
-    evaluator.evaluate_all()
-    evaluator.print_detailed_report()
+    await asyncio.to_thread(evaluate)
 
     # 保存日志
     if save_log:
@@ -189,38 +885,158 @@ def run_single_game(
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             log_path = f"game_log_{timestamp}.json"
 
-        game.save_game_log(log_path)
+        await asyncio.to_thread(game.save_game_log, log_path)
 
     return game_log
 
 
-def main():
+def run_single_game(
+    puzzle_data: Dict,
+    model_api_call: Callable,
+    max_rounds: int = 20,
+    players_config: list = None,
+    save_log: bool = True,
+    log_path: str = None,
+    embed_fn: Callable = None,
+    host_api_call: Callable = None,
+    evaluator_api_call: Callable = None,
+    evaluation_cache: ResponseCache = None
+) -> Dict:
+    """
+    运行单个游戏
+
+    Args:
+        puzzle_data: 谜题数据
+        model_api_call: LLM API调用函数
+        max_rounds: 最大回合数
+        players_config: 玩家配置
+        save_log: 是否保存游戏日志
+        log_path: 日志保存路径
+        embed_fn: 可选的向量化函数，用于在评估关键问题覆盖率时减少LLM调用
+        host_api_call: 主持人专用的LLM调用函数（如create_local_api_call创建的本地小模型）
+        evaluator_api_call: 评估专用的LLM调用函数（如create_openai_batch_api_call创建的批处理函数），
+            不提供时使用model_api_call
+        evaluation_cache: 评估结果缓存（如 ResponseCache("evaluations.sqlite", namespace=模型名)），
+            重复评估相同内容时直接使用缓存的结果
+
+    Returns:
+        游戏日志（包含评估结果）
+    """
+    async def play() -> Dict:
+        try:
+            return await run_single_game_async(
+                puzzle_data, model_api_call, max_rounds, players_config, save_log, log_path,
+                embed_fn, host_api_call, evaluator_api_call, evaluation_cache
+            )
+        finally:
+            # 在事件循环结束前关闭异步客户端的连接池
+            await aclose_models(model_api_call, host_api_call, evaluator_api_call)
+
+    return asyncio.run(play())
+
+
+async def run_games_async(
+    puzzles: List[Dict],
+    model_api_call: Callable,
+    max_parallel_games: int = 4,
+    log_dir: str = ".",
+    **game_kwargs
+) -> List[Dict]:
+    """
+    并发运行多个谜题的游戏，同时进行的游戏数不超过max_parallel_games（用于遵守服务商的速率限制）
+
+    Args:
+        puzzles: 谜题数据列表
+        model_api_call: LLM API调用函数
+        max_parallel_games: 同时进行的最大游戏数
+        log_dir: 日志保存目录，每局保存为 game_log_<时间>_game<序号>.json（序号为谜题在puzzles中的位置，
+            谜题编号记录在日志的puzzle_index中）
+        **game_kwargs: 传给run_single_game_async的其他参数（如max_rounds、players_config）
+
+    Returns:
+        按puzzles顺序排列的游戏日志（各局的评估报告在全部结束后按同样的顺序输出）
+    """
+    import datetime
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    semaphore = asyncio.Semaphore(max_parallel_games)
+
+    async def bounded(i: int, puzzle: Dict) -> Dict:
+        async with semaphore:
+            log_path = os.path.join(log_dir, f"game_log_{timestamp}_game{i}.json")
+            return await run_single_game_async(
+                puzzle, model_api_call, log_path=log_path, print_report=False, **game_kwargs
+            )
+
+    try:
+        game_logs = await asyncio.gather(*(bounded(i, puzzle) for i, puzzle in enumerate(puzzles)))
+    finally:
+        await aclose_models(
+            model_api_call, game_kwargs.get("host_api_call"), game_kwargs.get("evaluator_api_call")
+        )
+
+    # 各局同时评估，报告在全部结束后按谜题顺序输出
+    for game_log in game_logs:
+        print(GameEvaluator.format_report(game_log))
+    return game_logs
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="海龟汤游戏 - Agent推理实验")
+    parser.add_argument("--api", choices=["openai", "anthropic", "mock"], default="mock",
+                        help="使用的LLM API（默认mock，不调用真实API）")
+    parser.add_argument("--model", default=None, help="模型名称（默认使用各API的默认模型）")
+    parser.add_argument("--data", default="test.json", help="谜题数据文件")
+    parser.add_argument("--puzzles", nargs="+", default=["0"],
+                        help="要运行的谜题索引，如 --puzzles 0 2 5；传入all运行全部谜题")
+    parser.add_argument("--max-rounds", type=int, default=20, help="每局最大回合数")
+    parser.add_argument("--max-parallel-games", type=int, default=4, help="同时进行的最大游戏数")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="每分钟最多API请求数（按服务商的速率限制设置，默认不限制）")
+    parser.add_argument("--structured-output", action="store_true",
+                        help="玩家回合使用结构化输出（需要模型支持JSON Schema或工具调用）")
+    parser.add_argument("--cache-path", default=None, help="响应缓存的SQLite文件路径")
+    parser.add_argument("--evaluation-cache-path", default="evaluations.sqlite",
+                        help="评估结果缓存的SQLite文件路径，相同内容不再重复评估；传入空字符串关闭")
+    parser.add_argument("--quiet", action="store_true", help="不输出逐回合的游戏过程（适合批量运行）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """
     主函数 - 运行实验
     """
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.WARNING if args.quiet else logging.INFO,
+        stream=sys.stdout,
+        format="%(message)s"
+    )
+
     print("="*60)
     print("海龟汤游戏 - Agent推理实验")
     print("="*60)
 
     # 1. 加载谜题数据
     print("\n加载谜题数据...")
-    puzzle_data = load_puzzle_data("test.json", puzzle_index=0)
-    print(f"已加载谜题 #{puzzle_data.get('index', 0)}")
+    if args.puzzles == ["all"]:
+        puzzles = load_puzzles(args.data)
+    else:
+        puzzles = [load_puzzle_data(args.data, puzzle_index=int(i)) for i in args.puzzles]
+    print(f"已加载 {len(puzzles)} 个谜题")
 
     # 2. 选择API
-    print("\n选择LLM API:")
-    print("1. OpenAI (需要设置OPENAI_API_KEY)")
-    print("2. Anthropic (需要设置ANTHROPIC_API_KEY)")
-    print("3. Mock API (测试模式，不调用真实API)")
-
-    choice = input("\n请选择 (1/2/3): ").strip()
-
-    if choice == "1":
+    model_kwargs = {"model": args.model} if args.model else {}
+    if args.rpm:
+        model_kwargs["rpm"] = args.rpm
+    if args.structured_output:
+        model_kwargs["structured_output"] = True
+    if args.api == "openai":
         print("\n使用OpenAI API...")
-        model_api_call = create_openai_api_call()
-    elif choice == "2":
+        model_api_call = create_openai_api_call(cache_path=args.cache_path, **model_kwargs)
+    elif args.api == "anthropic":
         print("\n使用Anthropic API...")
-        model_api_call = create_anthropic_api_call()
+        model_api_call = create_anthropic_api_call(cache_path=args.cache_path, **model_kwargs)
     else:
         print("\n使用Mock API (测试模式)...")
         model_api_call = create_mock_api_call()
@@ -230,20 +1046,27 @@ def main():
         {"name": "Player1", "strategy": "systematic"},
         {"name": "Player2", "strategy": "creative"}
     ]
-    max_rounds = 20
 
-    # 4. 运行游戏
+    # 4. 运行游戏（多个谜题并发进行）
     print("\n" + "="*60)
     print("开始游戏...")
     print("="*60)
 
-    game_log = run_single_game(
-        puzzle_data=puzzle_data,
-        model_api_call=model_api_call,
-        max_rounds=max_rounds,
+    evaluation_cache = None
+    if args.evaluation_cache_path:
+        evaluation_cache = ResponseCache(
+            args.evaluation_cache_path,
+            namespace=f"{args.api}:{args.model or 'default'}"
+        )
+
+    asyncio.run(run_games_async(
+        puzzles,
+        model_api_call,
+        max_parallel_games=args.max_parallel_games,
+        max_rounds=args.max_rounds,
         players_config=players_config,
-        save_log=True
-    )
+        evaluation_cache=evaluation_cache
+    ))
 
     print("\n" + "="*60)
     print("实验完成！")